@@ -1,45 +1,115 @@
 import os
 import sys
 import time
+import mmap
 import struct
-#import signal
+import signal
+import threading
+import collections
+import io
+import shlex
+import contextlib
+import concurrent.futures
 from mini_rv32ima_decoder import *
+from mini_rv32ima_translator import MiniRV32IMAStepBlocks, MiniRV32IMATranslationCache
+from mini_rv32ima_profile import MiniRV32IMAProfiler
+from mini_rv32ima_trace import MiniRV32IMATracer
 from default64mbdtc import *
 
 # Constants
 MINI_RV32_RAM_SIZE = 64 * 1024 * 1024
 MINIRV32_RAM_IMAGE_OFFSET = 0x80000000
-MINIRV32_MMIO_RANGE = lambda n: 0x10000000 <= n < 0x12000000
 
-# Global variables
-core = None
-fail_on_all_faults = False
+# Snapshot file: header, packed processor state and device registers, then the
+# RAM image starting on a page boundary so it can be read (or mapped) straight
+# into place.
+# An incremental snapshot names its parent after the state and, instead of the
+# whole image, holds a table of (first page, page count) runs followed by the
+# contents of those pages.  The ids tie each snapshot to the parent it was
+# taken against.
+SNAPSHOT_MAGIC = b'RV32SNAP'
+SNAPSHOT_VERSION = 4
+SNAPSHOT_HEADER = struct.Struct('<8sIIIQQ')  # magic, version, RAM size, runs, id, parent id
+SNAPSHOT_DEVICES = struct.Struct('<6I32B8I4Q')  # UART, PLIC and virtio registers, after the processor state
+SNAPSHOT_RAM_OFFSET = 4096
 
-SET_RAM_SIZE(MINI_RV32_RAM_SIZE)
+# Console output.
+# Guest output is collected in the machine's console_buffer and handed to its
+# console in one go on a newline, once CONSOLE_FLUSH_SIZE bytes are pending,
+# CONSOLE_FLUSH_US after the first pending byte, when the guest idles and when
+# the run ends.  main() writes it to the -o file or stdout.
+CONSOLE_FLUSH_SIZE = 4096
+CONSOLE_FLUSH_US = 20000
 
-def MINIRV32_POSTEXEC(pc, ir, retval):
-    if retval > 0:
-        if fail_on_all_faults:
-            print("FAULT")
-            return 3
-        else:
-            retval = HandleException(ir, retval)
-    return retval
+# Execution quantum.
+# A machine runs the guest in slices and only looks at the timer, the keyboard
+# and the console between them.  A slice runs up to the next timer deadline, as
+# far as it can be told in instructions: exactly with -l, otherwise three
+# quarters of the way there at the measured instructions per microsecond, so
+# slices shrink as the deadline nears.  It is kept short while typed input
+# is waiting so the UART interrupt is not held back.  Setting the timer
+# compare register ends the slice, its deadline may be sooner.  Instruction
+# budgets (-c, -i, run()) count what the slices executed, from the cycle
+# counter, not what they were given.
+QUANTUM_MIN = 64
+QUANTUM_MAX = 65536
+QUANTUM_IO = 4096
+QUANTUM_END = 2  # Returned by a step cut short
 
-def MINIRV32_HANDLE_MEM_STORE_CONTROL(addy, val):
-    if HandleControlStore(addy, val):
-        return val
-    else:
-        return None
+# Longest sleep in WFI, so snapshot requests are still served while the guest
+# waits for an interrupt that may never come.
+IDLE_MAX_US = 100000
+
+# Memory map of the devices, as in the default device tree.  The bus maps them
+# in pages of 1 << MMIO_PAGE_SHIFT bytes.
+PLIC_BASE = 0x0c000000
+PLIC_SIZE = 0x04000000
+UART_BASE = 0x10000000
+VIRTIO_BASE = 0x10001000
+CLINT_BASE = 0x11000000
+CLINT_SIZE = 0x10000
+SYSCON_BASE = 0x11100000
+MMIO_PAGE_SHIFT = 12
 
-def MINIRV32_HANDLE_MEM_LOAD_CONTROL(addy):
-    return HandleControlLoad(addy)
+# Interrupt controller.
+# A single context PLIC (hart 0, machine mode) in the layout of the SiFive one,
+# driving MEIP.  Sources are level triggered: a source is pending while its
+# line is up and it has not been claimed, completing it lets it fire again.
+# The UART is source 1, the block device 2.
+PLIC_NDEV = 31
+UART_IRQ = 1
+VIRTIO_IRQ = 2
 
-def MINIRV32_OTHERCSR_WRITE(image, csrno, value):
-    HandleOtherCSRWrite(image, csrno, value)
+# Block device.
+# A virtio-mmio (version 2) block device with a single request queue, backed by
+# a disk image mapped into memory.  Sectors are copied straight between the
+# mapping and guest RAM, and only the parts of the image the guest reads are
+# ever loaded from the file.  Requests are served when the guest notifies the
+# queue.  Without a disk the slot reads as device 0, which drivers skip.
+VIRTIO_QUEUE_MAX = 128
+VIRTIO_F_VERSION_1 = 1 << 32
+VIRTIO_BLK_F_RO = 1 << 5
+VIRTIO_BLK_F_FLUSH = 1 << 9
+VIRTIO_STATUS_NEEDS_RESET = 0x40
+VIRTQ_DESC_F_NEXT = 1
+VIRTQ_DESC_F_WRITE = 2
+VIRTIO_BLK_T_IN = 0
+VIRTIO_BLK_T_OUT = 1
+VIRTIO_BLK_T_FLUSH = 4
+VIRTIO_BLK_T_GET_ID = 8
+VIRTIO_BLK_S_OK = 0
+VIRTIO_BLK_S_IOERR = 1
+VIRTIO_BLK_S_UNSUPP = 2
+VIRTIO_BLK_SECTOR = 512
+VIRTIO_BLK_ID = b'mini-rv32ima'
 
-def MINIRV32_OTHERCSR_READ(image, csrno):
-    return HandleOtherCSRRead(image, csrno)
+# Global variables
+# Only what belongs to the process rather than to a guest: the SIGUSR1 flag and
+# the snapshot chain of main(), and the one thread reading the keyboard.
+snapshot_requested = False
+snapshot_parent = None
+keyboard_reader = None
+keyboard_machine = None
 
 # Functions
 
@@ -49,42 +119,95 @@ def MINIRV32_OTHERCSR_READ(image, csrno):
 if os.name == "nt":
     import msvcrt
 
-    def CaptureKeyboardInput():
+    def CaptureKeyboardInput(machine):
         #Poorly documented tick: Enable VT100 Windows mode.
         os.system(" ")
-        pass
-
-    def IsKBHit():
-        return 1 if msvcrt.kbhit() else 0
+        StartKeyboardReader(machine, msvcrt.getch)
 
-    def ReadKBByte():
-        char =  ord(msvcrt.getch()) 
-        return char
+    def MapFileIntoRAM(image, f, offset, length):
+        return False
     
 if os.name == "posix":
-    import select, termios
+    import termios
+    import ctypes
 
-    def CaptureKeyboardInput():
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long)
+    MAP_FIXED = 0x10
+
+    def CaptureKeyboardInput(machine):
         fd = sys.stdin.fileno()
-        old_term = termios.tcgetattr(fd)  # (For restoring later.)
+        if os.isatty(fd):
+            old_term = termios.tcgetattr(fd)  # (For restoring later.)
+
+            # Create new unbufferd terminal settings to use:
+            new_term = termios.tcgetattr(fd)
+            new_term[3] = (new_term[3] & ~termios.ICANON & ~termios.ECHO)
+            termios.tcsetattr(fd, termios.TCSAFLUSH, new_term)
+        StartKeyboardReader(machine, lambda: os.read(fd, 4096))
+
+    def MapFileIntoRAM(image, f, offset, length):
+        # Maps length bytes of f at offset copy-on-write over the start of the
+        # image: pages the guest never writes stay shared with the page cache
+        # (and every other emulator mapping the same file).  The file must not
+        # be truncated while mapped; snapshots are replaced by rename, never
+        # rewritten in place.  Returns False if the caller has to read the
+        # file instead.
+        if not length or offset % mmap.PAGESIZE or length > len(image):
+            return False
+        if os.fstat(f.fileno()).st_size < offset + length:
+            return False
+        base = ctypes.addressof(ctypes.c_char.from_buffer(image))
+        addr = libc.mmap(base, length, mmap.PROT_READ | mmap.PROT_WRITE, mmap.MAP_PRIVATE | MAP_FIXED, f.fileno(), offset)
+        return addr == base
 
-        # Create new unbufferd terminal settings to use:
-        new_term = termios.tcgetattr(fd)
-        new_term[3] = (new_term[3] & ~termios.ICANON & ~termios.ECHO)
-        termios.tcsetattr(fd, termios.TCSAFLUSH, new_term)
+def OpenDisk(file_name):
+    # Maps a disk image for the block device.  The mapping is shared, so what
+    # the guest writes goes to the file; read only if the file is.
+    try:
+        f = open(file_name, "r+b")
+        access = mmap.ACCESS_WRITE
+    except PermissionError:
+        f = open(file_name, "rb")
+        access = mmap.ACCESS_READ
+    with f:
+        return mmap.mmap(f.fileno(), 0, access=access)
+
+#
+# Keyboard input
+#
+# A daemon thread blocks reading the keyboard and hands what it gets to the
+# machine it was captured for, so the guest polling the UART only looks at the
+# machine's keyboard_queue and never makes a system call.  There is one reader
+# per process, a later capture only redirects it.  The reader holds off while
+# KEYBOARD_QUEUE_MAX bytes are pending, e.g. from a pipe.
+KEYBOARD_QUEUE_MAX = 65536
 
-    def IsKBHit():
-        results = select.select([sys.stdin], [], [], 0)
-        return results[0] != []
+def KeyboardReader(read):
+    while True:
+        data = read()
+        if not data:
+            return
+        machine = keyboard_machine
+        while len(machine.keyboard_queue) >= KEYBOARD_QUEUE_MAX:
+            time.sleep(0.01)
+        machine.send(data)
 
-    def ReadKBByte():
-        return ord(sys.stdin.read(1))
+def StartKeyboardReader(machine, read):
+    global keyboard_reader, keyboard_machine
+    keyboard_machine = machine
+    if keyboard_reader is None:
+        keyboard_reader = threading.Thread(target=KeyboardReader, args=(read,), daemon=True)
+        keyboard_reader.start()
 
 def SimpleReadNumberInt(number, defaultNumber):
     if not number or not number[0]:
         return defaultNumber
     radix = 10
     if number[0] == '0':
+        if len(number) == 1:
+            return 0
         nc = number[1]
         number = number[2:]
         if nc == '0':
@@ -102,71 +225,810 @@ def SimpleReadNumberInt(number, defaultNumber):
         return defaultNumber
 
 def GetTimeMicroseconds():
-    return int(time.time() * 1000000)
-
-def MiniSleep():
-    time.sleep(0.0005)
+    return time.monotonic_ns() // 1000
 
 def HandleException(ir, code):
     if code == 3:
         pass
     return code
 
-def HandleControlStore(addy, val):
-    if addy == 0x10000000:
-        print(chr(val), end='', flush=True)
-    elif addy == 0x11004004:
-        core.timermatchh = val
-    elif addy == 0x11004000:
-        core.timermatchl = val
-    elif addy == 0x11100000:
-        core.pc += 4
-        return val
-    return 0
-
-def HandleControlLoad(addy):
-    if addy == 0x10000005:
-        return 0x60 | IsKBHit()
-    elif addy == 0x10000000 and IsKBHit():
-        return ReadKBByte()
-    elif addy == 0x1100bffc:
-        return core.timerh
-    elif addy == 0x1100bff8:
-        return core.timerl
-    return 0
-
-def HandleOtherCSRWrite(image, csrno, value):
-    if csrno == 0x136:
-        print(value, end='', flush=True)
-    elif csrno == 0x137:
-        print(f"{value:08x}", end='', flush=True)
-    elif csrno == 0x138:
-        ptrstart = value - MINIRV32_RAM_IMAGE_OFFSET
-        ptrend = ptrstart
-        if ptrstart >= MINI_RV32_RAM_SIZE:
-            print(f"DEBUG PASSED INVALID PTR ({value:08x})")
-        while ptrend < MINI_RV32_RAM_SIZE:
-            if image[ptrend] == 0:
+#
+# Devices
+#
+# MMIO goes through a bus mapping whole pages of the address space to device
+# objects, so finding the device is one dict lookup however many are mapped.
+# A device has load(ofs) and store(ofs, val) for accesses at an offset from
+# where it is mapped; store returns 0, or a value to end the step with (see
+# MiniRV32IMAStep).  Pages without a device fault.
+class DeviceBus:
+    def __init__(self):
+        self.pages = {}  # page -> (device, base)
+
+    def map(self, base, size, device):
+        page_mask = (1 << MMIO_PAGE_SHIFT) - 1
+        if base & page_mask or size <= 0:
+            raise ValueError(f"device at {base:08x} is not page aligned")
+        pages = range(base >> MMIO_PAGE_SHIFT, (base + size + page_mask) >> MMIO_PAGE_SHIFT)
+        if any(page in self.pages for page in pages):
+            raise ValueError(f"device at {base:08x} overlaps one mapped before")
+        for page in pages:
+            self.pages[page] = (device, base)
+
+    def load(self, addy):
+        try:
+            device, base = self.pages[addy >> MMIO_PAGE_SHIFT]
+        except KeyError:
+            raise MiniRV32IMATrap(5 + 1, addy) from None
+        return device.load(addy - base)
+
+    def store(self, addy, val):
+        try:
+            device, base = self.pages[addy >> MMIO_PAGE_SHIFT]
+        except KeyError:
+            raise MiniRV32IMATrap(7 + 1, addy) from None
+        return device.store(addy - base, val)
+
+class Uart:
+    # The registers of a 16550 a driver needs: RBR/THR, IER, IIR/FCR and LSR.
+    # Input comes from the machine's keyboard queue, output goes to its
+    # console.
+    def __init__(self, machine):
+        self.machine = machine
+        self.ier = 0
+        self.fcr = 0
+        self.thre = 0
+
+    def irq_line(self):
+        # Received data or an empty transmitter, if enabled in IER.
+        return (self.ier & 1 and self.machine.keyboard_queue) or (self.ier & 2 and self.thre)
+
+    def read_iir(self):
+        if self.ier & 1 and self.machine.keyboard_queue:
+            iir = 0x04
+        elif self.ier & 2 and self.thre:
+            iir = 0x02
+            self.thre = 0  # Reading it acknowledges the transmitter interrupt
+        else:
+            iir = 0x01
+        self.machine.update_interrupts()
+        return iir | (0xC0 if self.fcr else 0)
+
+    def load(self, ofs):
+        if ofs == 5:
+            return 0x61 if self.machine.keyboard_queue else 0x60
+        elif ofs == 0 and self.machine.keyboard_queue:
+            c = self.machine.read_kb_byte()
+            self.machine.update_interrupts()
+            return c
+        elif ofs == 1:
+            return self.ier
+        elif ofs == 2:
+            return self.read_iir()
+        return 0
+
+    def store(self, ofs, val):
+        if ofs == 0:
+            self.machine.console_putc(val & 0xFF)
+            self.thre = 1  # Sent right away, the transmitter is empty again
+            self.machine.update_interrupts()
+        elif ofs == 1:
+            self.ier = val & 0x0F
+            if val & 2:
+                self.thre = 1
+            self.machine.update_interrupts()
+        elif ofs == 2:
+            self.fcr = val & 1
+        return 0
+
+class Plic:
+    # See PLIC_NDEV.  attach() connects a source to a function telling whether
+    # its line is up.
+    def __init__(self, core):
+        self.core = core
+        self.sources = {}
+        self.priority = bytearray(PLIC_NDEV + 1)
+        self.enable = 0
+        self.threshold = 0
+        self.claimed = 0
+
+    def attach(self, src, line):
+        self.sources[src] = line
+
+    def pending(self):
+        pending = 0
+        for src, line in self.sources.items():
+            if line():
+                pending |= 1 << src
+        return pending & ~self.claimed
+
+    def next(self):
+        # The enabled pending source of highest priority above the threshold,
+        # the lowest id among equals, or 0.
+        pending = self.pending() & self.enable
+        priority = self.priority
+        best = 0
+        best_priority = self.threshold
+        while pending:
+            src = (pending & -pending).bit_length() - 1
+            if priority[src] > best_priority:
+                best = src
+                best_priority = priority[src]
+            pending &= pending - 1
+        return best
+
+    def update(self):
+        # Recomputes MEIP.
+        if self.next():
+            self.core.mip |= 1 << 11
+        else:
+            self.core.mip &= ~(1 << 11)
+
+    def load(self, ofs):
+        if 0 < ofs <= PLIC_NDEV * 4 and not ofs & 3:
+            return self.priority[ofs >> 2]
+        elif ofs == 0x1000:
+            return self.pending()
+        elif ofs == 0x2000:
+            return self.enable
+        elif ofs == 0x200000:
+            return self.threshold
+        elif ofs == 0x200004:
+            src = self.next()
+            if src:
+                self.claimed |= 1 << src
+                self.update()
+            return src
+        return 0
+
+    def store(self, ofs, val):
+        if 0 < ofs <= PLIC_NDEV * 4 and not ofs & 3:
+            self.priority[ofs >> 2] = val & 7
+        elif ofs == 0x2000:
+            self.enable = val & ((2 << PLIC_NDEV) - 2)
+        elif ofs == 0x200000:
+            self.threshold = val & 7
+        elif ofs == 0x200004:
+            if 0 < val <= PLIC_NDEV:
+                self.claimed &= ~(1 << val)
+        self.update()
+        return 0
+
+class Clint:
+    # The timer and its compare register, kept in the processor state.
+    def __init__(self, core):
+        self.core = core
+
+    def load(self, ofs):
+        if ofs == 0xbffc:
+            return self.core.timerh
+        elif ofs == 0xbff8:
+            return self.core.timerl
+        return 0
+
+    def store(self, ofs, val):
+        if ofs == 0x4004:
+            self.core.timermatchh = val
+            return QUANTUM_END
+        elif ofs == 0x4000:
+            self.core.timermatchl = val
+            return QUANTUM_END
+        return 0
+
+class Syscon:
+    # Writing 0x5555 powers off, 0x7777 restarts.
+    def load(self, ofs):
+        return 0
+
+    def store(self, ofs, val):
+        return val if ofs == 0 else 0
+
+def VirtioSlices(segments, start, end):
+    # The (RAM offset, length) pieces holding bytes start to end of the
+    # buffer that the (RAM offset, length) segments of a request make up.
+    pos = 0
+    for ofs, length in segments:
+        lo = max(start - pos, 0)
+        hi = min(end - pos, length)
+        if lo < hi:
+            yield ofs + lo, hi - lo
+        pos += length
+
+class VirtioBlk:
+    # The block device described at VIRTIO_QUEUE_MAX.  disk is a buffer
+    # holding the image, normally an mmap of its file, or None.
+    def __init__(self, machine, disk=None):
+        self.machine = machine
+        self.disk = disk
+        self.disk_view = memoryview(disk) if disk is not None else None
+        self.read_only = disk is not None and self.disk_view.readonly
+        self.features = VIRTIO_F_VERSION_1 | VIRTIO_BLK_F_FLUSH | (VIRTIO_BLK_F_RO if self.read_only else 0)
+        capacity = len(disk) // VIRTIO_BLK_SECTOR if disk is not None else 0
+        self.config = struct.pack('<Q', capacity)
+        self.reset()
+
+    def reset(self):
+        self.status = 0
+        self.device_features_sel = 0
+        self.driver_features = 0
+        self.driver_features_sel = 0
+        self.queue_sel = 0
+        self.queue_num = 0
+        self.queue_ready = 0
+        self.queue_desc = 0
+        self.queue_driver = 0
+        self.queue_device = 0
+        self.interrupt_status = 0
+        self.last_avail = 0
+
+    def irq_line(self):
+        return self.interrupt_status
+
+    def load(self, ofs):
+        if ofs >= 0x100:
+            return int.from_bytes(self.config[ofs - 0x100:ofs - 0x100 + 4], 'little')
+        elif ofs == 0x000:
+            return 0x74726976  # "virt"
+        elif ofs == 0x004:
+            return 2
+        elif ofs == 0x008:
+            return 2 if self.disk is not None else 0
+        elif ofs == 0x00c:
+            return 0x554d4551
+        elif ofs == 0x010:
+            return (self.features >> (32 * self.device_features_sel)) & 0xFFFFFFFF if self.device_features_sel < 2 else 0
+        elif self.queue_sel:
+            return 0  # Only queue 0 exists
+        elif ofs == 0x034:
+            return VIRTIO_QUEUE_MAX
+        elif ofs == 0x044:
+            return self.queue_ready
+        elif ofs == 0x060:
+            return self.interrupt_status
+        elif ofs == 0x070:
+            return self.status
+        return 0
+
+    def store(self, ofs, val):
+        if ofs == 0x014:
+            self.device_features_sel = val
+        elif ofs == 0x020:
+            if self.driver_features_sel < 2:
+                shift = 32 * self.driver_features_sel
+                self.driver_features = (self.driver_features & ~(0xFFFFFFFF << shift)) | (val & self.features >> shift) << shift
+        elif ofs == 0x024:
+            self.driver_features_sel = val
+        elif ofs == 0x030:
+            self.queue_sel = val
+        elif ofs == 0x050:
+            if val == 0 and self.queue_ready:
+                return self.notify()
+        elif ofs == 0x064:
+            self.interrupt_status &= ~val
+            self.machine.update_interrupts()
+        elif ofs == 0x070:
+            if val == 0:
+                self.reset()
+                self.machine.update_interrupts()
+            else:
+                self.status = val
+        elif self.queue_sel:
+            pass
+        elif ofs == 0x038:
+            if 0 < val <= VIRTIO_QUEUE_MAX:
+                self.queue_num = val
+        elif ofs == 0x044:
+            self.queue_ready = val & 1
+            if not self.queue_ready:
+                self.last_avail = 0
+        elif ofs == 0x080:
+            self.queue_desc = (self.queue_desc & ~0xFFFFFFFF) | val
+        elif ofs == 0x084:
+            self.queue_desc = (self.queue_desc & 0xFFFFFFFF) | val << 32
+        elif ofs == 0x090:
+            self.queue_driver = (self.queue_driver & ~0xFFFFFFFF) | val
+        elif ofs == 0x094:
+            self.queue_driver = (self.queue_driver & 0xFFFFFFFF) | val << 32
+        elif ofs == 0x0a0:
+            self.queue_device = (self.queue_device & ~0xFFFFFFFF) | val
+        elif ofs == 0x0a4:
+            self.queue_device = (self.queue_device & 0xFFFFFFFF) | val << 32
+        return 0
+
+    def ram_offset(self, addr, length):
+        # The offset of guest RAM at addr, or -1 unless length bytes fit.
+        ofs = addr - MINIRV32_RAM_IMAGE_OFFSET
+        return ofs if 0 <= ofs and ofs + length <= len(self.machine.ram) else -1
+
+    def notify(self):
+        # Serves every request made available since the last notification.
+        ram = self.machine.ram
+        num = self.queue_num
+        desc = self.ram_offset(self.queue_desc, 16 * num)
+        avail = self.ram_offset(self.queue_driver, 6 + 2 * num)
+        used = self.ram_offset(self.queue_device, 6 + 8 * num)
+        if not num or desc < 0 or avail < 0 or used < 0:
+            self.status |= VIRTIO_STATUS_NEEDS_RESET
+            return 0
+
+        avail_idx = MINIRV32_LOAD2(ram, avail + 2)
+        used_idx = MINIRV32_LOAD2(ram, used + 2)
+        if self.last_avail == avail_idx:
+            return 0
+        while self.last_avail != avail_idx:
+            head = MINIRV32_LOAD2(ram, avail + 4 + 2 * (self.last_avail % num))
+            written = self.request(desc, head) if head < num else 0
+            elem = used + 4 + 8 * (used_idx % num)
+            MINIRV32_STORE4(ram, elem, head)
+            MINIRV32_STORE4(ram, elem + 4, written)
+            used_idx = (used_idx + 1) & 0xFFFF
+            self.last_avail = (self.last_avail + 1) & 0xFFFF
+        MINIRV32_STORE2(ram, used + 2, used_idx)
+        self.interrupt_status |= 1
+        self.machine.update_interrupts()
+        return QUANTUM_END  # So the completion interrupt is taken right away
+
+    def request(self, desc, index):
+        # Serves the request in the descriptor chain starting at index.
+        # Returns the number of bytes written to guest RAM.
+        ram = self.machine.ram
+        readable = []
+        writable = []
+        for _ in range(self.queue_num):
+            entry = desc + 16 * index
+            length = MINIRV32_LOAD4(ram, entry + 8)
+            flags = MINIRV32_LOAD2(ram, entry + 12)
+            ofs = self.ram_offset(MINIRV32_LOAD4(ram, entry) | MINIRV32_LOAD4(ram, entry + 4) << 32, length)
+            if ofs < 0:
+                return 0
+            (writable if flags & VIRTQ_DESC_F_WRITE else readable).append((ofs, length))
+            if not flags & VIRTQ_DESC_F_NEXT:
+                break
+            index = MINIRV32_LOAD2(ram, entry + 14)
+            if index >= self.queue_num:
+                return 0
+        else:
+            return 0  # A loop
+
+        readable_len = sum(length for ofs, length in readable)
+        data_len = sum(length for ofs, length in writable) - 1
+        if readable_len < 16 or data_len < 0:
+            return 0
+        header = b''.join(ram[ofs:ofs + length] for ofs, length in VirtioSlices(readable, 0, 16))
+        req_type, reserved, sector = struct.unpack('<IIQ', header)
+
+        written = 1
+        status = VIRTIO_BLK_S_OK
+        if req_type == VIRTIO_BLK_T_IN:
+            status = self.transfer(writable, 0, data_len, sector, True)
+            written += data_len
+        elif req_type == VIRTIO_BLK_T_OUT:
+            status = self.transfer(readable, 16, readable_len, sector, False)
+        elif req_type == VIRTIO_BLK_T_FLUSH:
+            if not self.read_only and hasattr(self.disk, "flush"):
+                self.disk.flush()
+        elif req_type == VIRTIO_BLK_T_GET_ID:
+            blk_id = VIRTIO_BLK_ID[:data_len]
+            pos = 0
+            for ofs, length in VirtioSlices(writable, 0, len(blk_id)):
+                ram[ofs:ofs + length] = blk_id[pos:pos + length]
+                MINIRV32_STORE_RANGE(ram, ofs, length)
+                pos += length
+            written += len(blk_id)
+        else:
+            status = VIRTIO_BLK_S_UNSUPP
+
+        for ofs, length in VirtioSlices(writable, data_len, data_len + 1):
+            MINIRV32_STORE1(ram, ofs, status)
+        return written
+
+    def transfer(self, segments, start, end, sector, to_ram):
+        # Copies bytes start to end of the request buffer from (to_ram) or to
+        # the disk at sector, straight between the two mappings.
+        pos = sector * VIRTIO_BLK_SECTOR
+        if self.disk is None or pos + end - start > len(self.disk) or (self.read_only and not to_ram):
+            return VIRTIO_BLK_S_IOERR
+        ram = self.machine.ram
+        disk_view = self.disk_view
+        with memoryview(ram) as ram_view:
+            for ofs, length in VirtioSlices(segments, start, end):
+                if to_ram:
+                    ram_view[ofs:ofs + length] = disk_view[pos:pos + length]
+                    MINIRV32_STORE_RANGE(ram, ofs, length)
+                else:
+                    disk_view[pos:pos + length] = ram_view[ofs:ofs + length]
+                pos += length
+        return VIRTIO_BLK_S_OK
+
+# Hypercalls.
+# Besides the debug CSRs (0x136 print decimal, 0x137 print hex, 0x138 print
+# the string at an address, 0x139 print a character, 0x140 read a key or -1),
+# the guest calls on the host by writing a hypercall number to HYPERCALL_CSR
+# with its arguments in a0-a2.  The result is left in a0 (a0 and a1 for the
+# clock), so nothing is kept between calls.  Each call is one host operation
+# over guest RAM however many bytes it covers, and one instruction to the
+# guest.  Addresses are physical; a range not in RAM gives -EFAULT.
+# mini_rv32ima_hypercall.h has the guest side.
+HYPERCALL_CSR = 0x141
+HYPERCALL_COPY = 1     # (dst, src, len) -> 0, overlapping ranges are fine
+HYPERCALL_FILL = 2     # (dst, byte, len) -> 0
+HYPERCALL_COMPARE = 3  # (a, b, len) -> -1, 0 or 1, like memcmp
+HYPERCALL_CLOCK = 4    # () -> host monotonic nanoseconds, low half in a0
+HYPERCALL_WRITE = 5    # (buf, len) -> len, written to the console
+HYPERCALL_EFAULT = -14 & 0xFFFFFFFF
+HYPERCALL_ENOSYS = -38 & 0xFFFFFFFF
+
+#
+# Machine
+#
+# One guest: its RAM, processor state, UART and PLIC, keyboard queue and console.
+# Everything the guest touches lives here and the decoder hooks are set on its
+# RAM, so any number of machines can run side by side in one process.
+#
+#   machine = Machine(console=None)        # None captures into machine.output
+#   machine.load_image(kernel)
+#   machine.load_dtb()
+#   machine.send(b"root\n")
+#   machine.run_until(lambda m: m.output.endswith(b"# "))
+#
+# run() and run_until() return 0x5555 when the guest powers off, 3 when it stops
+# on a fault, or None when the instruction budget runs out or the predicate
+# holds.  The predicate is checked between slices, so it may hold for up to
+# QUANTUM_MAX instructions before the run stops.
+class Machine:
+    def __init__(self, ram_amt=MINI_RV32_RAM_SIZE, console=None, use_blocks=False, time_divisor=1,
+                 fixed_update=False, do_sleep=True, single_step=False, fail_on_all_faults=False,
+                 ram=None, core=None, disk=None, translation_cache=None):
+        # console is called with each chunk of guest output; None collects it
+        # in self.output instead.  ram and core resume a machine, e.g. from
+        # LoadSnapshot(), otherwise it starts out at the beginning of RAM.
+        # disk backs the block device, see OpenDisk().  translation_cache
+        # keeps translated blocks across runs, see
+        # MiniRV32IMATranslationCache; saving it is up to the caller.
+        self.ram = ram if ram is not None else MiniRV32IMARam(ram_amt)
+        self.ram.translation_cache = translation_cache
+        if core is None:
+            core = MiniRV32IMAState()
+            core.pc = MINIRV32_RAM_IMAGE_OFFSET
+            core.regs[10] = 0x00
+            core.regs[11] = 0x00
+            core.extraflags |= 3
+        self.core = core
+        self.step = MiniRV32IMAStepBlocks if use_blocks and not single_step else MiniRV32IMAStep
+        self.time_divisor = time_divisor
+        self.fixed_update = fixed_update
+        self.do_sleep = do_sleep
+        self.single_step = single_step
+        self.fail_on_all_faults = fail_on_all_faults
+        self.faulted = False
+        self.last_time = None  # Set by the first slice
+        self.rate = 1.0  # Instructions per host microsecond
+
+        # deque appends and pops are atomic, the keyboard reader thread
+        # fills keyboard_queue without a lock.  keyboard_event is set whenever
+        # input arrives, to wake an idle guest.
+        self.keyboard_queue = collections.deque()
+        self.keyboard_event = threading.Event()
+
+        # With a console, output is buffered and flushed as described at
+        # CONSOLE_FLUSH_SIZE.  Without one the buffer is the output.
+        self.console = console
+        self.console_buffer = bytearray()
+        self.console_since = 0
+        self.output = self.console_buffer if console is None else None
+
+        self.uart = Uart(self)
+        self.plic = Plic(core)
+        self.virtio = VirtioBlk(self, disk)
+        self.plic.attach(UART_IRQ, self.uart.irq_line)
+        self.plic.attach(VIRTIO_IRQ, self.virtio.irq_line)
+        self.bus = DeviceBus()
+        self.bus.map(PLIC_BASE, PLIC_SIZE, self.plic)
+        self.bus.map(UART_BASE, 1 << MMIO_PAGE_SHIFT, self.uart)
+        self.bus.map(VIRTIO_BASE, 1 << MMIO_PAGE_SHIFT, self.virtio)
+        self.bus.map(CLINT_BASE, CLINT_SIZE, Clint(core))
+        self.bus.map(SYSCON_BASE, 1 << MMIO_PAGE_SHIFT, Syscon())
+
+        SET_HANDLERS(self.ram, self.postexec, self.bus.store, self.bus.load,
+                     self.handle_other_csr_write, self.handle_other_csr_read)
+
+    def load_image(self, data, offset=0):
+        if offset + len(data) > len(self.ram):
+            raise ValueError(f"Could not fit RAM image ({len(data)} bytes) into {len(self.ram)}")
+        self.ram[offset:offset + len(data)] = data
+        # The machine may have run already: drop stale decodes and mark the
+        # pages for the next snapshot.
+        MINIRV32_STORE_RANGE(self.ram, offset, len(data))
+
+    def load_dtb(self, dtb=None, kernel_command_line=None):
+        # Places a device tree at the top of RAM, below the space kept for the
+        # processor state, and passes it to the guest in a1.  Without one it
+        # is the built-in tree, with the kernel command line and the size of
+        # RAM patched in.
+        data = default64mbdtb if dtb is None else dtb
+        ram_image = self.ram
+        dtb_ptr = len(ram_image) - len(data) - MINIRV32_STATE_SIZE
+        ram_image[dtb_ptr:dtb_ptr + len(data)] = data
+        if dtb is None:
+            if kernel_command_line:
+                ram_image[dtb_ptr+0xc0:dtb_ptr+0xc0+len(kernel_command_line)] = kernel_command_line.encode()
+            ptr = dtb_ptr + 0x13c
+            if struct.unpack('<I', ram_image[ptr:ptr+4])[0] == 0x00c0ff03:
+                ram_image[ptr:ptr+4] = struct.pack('>I', dtb_ptr)
+        MINIRV32_STORE_RANGE(ram_image, dtb_ptr, len(data))
+        self.core.regs[11] = dtb_ptr + MINIRV32_RAM_IMAGE_OFFSET
+
+    #
+    # Keyboard and console
+    #
+    def send(self, data):
+        # Types data ahead for the guest to read from the UART.
+        self.keyboard_queue.extend(data)
+        self.keyboard_event.set()
+
+    def is_kb_hit(self):
+        return 1 if self.keyboard_queue else 0
+
+    def read_kb_byte(self):
+        return self.keyboard_queue.popleft()
+
+    def console_write(self, data):
+        if not self.console_buffer:
+            self.console_since = GetTimeMicroseconds()
+        self.console_buffer.extend(data)
+        if b'\n' in data or len(self.console_buffer) >= CONSOLE_FLUSH_SIZE:
+            self.console_flush()
+
+    def console_putc(self, c):
+        if not self.console_buffer:
+            self.console_since = GetTimeMicroseconds()
+        self.console_buffer.append(c)
+        if c == 10 or len(self.console_buffer) >= CONSOLE_FLUSH_SIZE:
+            self.console_flush()
+
+    def console_poll(self):
+        # Called between steps, flushes output that has been pending too long.
+        if self.console_buffer and GetTimeMicroseconds() - self.console_since >= CONSOLE_FLUSH_US:
+            self.console_flush()
+
+    def console_flush(self):
+        if not self.console_buffer or self.console is None:
+            return
+        self.console(bytes(self.console_buffer))
+        self.console_buffer.clear()
+
+    def host_message(self, text):
+        # A line from the emulator itself (FAULT, POWEROFF), after the guest
+        # output before it and through the same console.
+        self.console_flush()
+        self.console_write(text.encode() + b'\n')
+
+    def sleep(self, us):
+        # Sleeps for us microseconds, or until a key is sent if none is
+        # pending.  A pending key the guest left unread does not wake it early.
+        self.keyboard_event.clear()
+        if self.keyboard_queue:
+            time.sleep(us / 1000000)
+        else:
+            self.keyboard_event.wait(us / 1000000)
+
+    #
+    # Devices
+    #
+    def devices_to_bytes(self):
+        uart = self.uart
+        plic = self.plic
+        virtio = self.virtio
+        return SNAPSHOT_DEVICES.pack(uart.ier, uart.fcr, uart.thre, plic.enable,
+                                     plic.threshold, plic.claimed, *plic.priority,
+                                     virtio.status, virtio.device_features_sel, virtio.driver_features_sel,
+                                     virtio.queue_sel, virtio.queue_num, virtio.queue_ready,
+                                     virtio.interrupt_status, virtio.last_avail, virtio.driver_features,
+                                     virtio.queue_desc, virtio.queue_driver, virtio.queue_device)
+
+    def devices_from_bytes(self, buffer, offset=0):
+        uart = self.uart
+        plic = self.plic
+        virtio = self.virtio
+        fields = SNAPSHOT_DEVICES.unpack_from(buffer, offset)
+        uart.ier, uart.fcr, uart.thre, plic.enable, plic.threshold, plic.claimed = fields[:6]
+        plic.priority[:] = bytes(fields[6:6 + PLIC_NDEV + 1])
+        (virtio.status, virtio.device_features_sel, virtio.driver_features_sel,
+         virtio.queue_sel, virtio.queue_num, virtio.queue_ready,
+         virtio.interrupt_status, virtio.last_avail, virtio.driver_features,
+         virtio.queue_desc, virtio.queue_driver, virtio.queue_device) = fields[6 + PLIC_NDEV + 1:]
+
+    def update_interrupts(self):
+        # Called between steps, since the keyboard reader fills
+        # keyboard_queue behind the guest's back, and after every access to
+        # the UART or PLIC registers.
+        self.plic.update()
+
+    #
+    # Decoder hooks
+    #
+    def postexec(self, pc, ir, trap):
+        # With fail_on_all_faults the fault is not taken: the step ends at the
+        # faulting instruction and the slice returns 3.
+        if self.fail_on_all_faults:
+            self.host_message("FAULT")
+            self.faulted = True
+            return 0
+        return HandleException(ir, trap)
+
+    def handle_other_csr_write(self, image, csrno, value):
+        if csrno == 0x136:
+            self.console_write(str(value).encode())
+        elif csrno == 0x137:
+            self.console_write(f"{value:08x}".encode())
+        elif csrno == 0x138:
+            ptrstart = (value - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+            if ptrstart >= len(image):
+                self.console_write(f"DEBUG PASSED INVALID PTR ({value:08x})\n".encode())
+                return
+            ptrend = image.find(b'\0', ptrstart)
+            if ptrend < 0:
+                ptrend = len(image)
+            self.console_write(image[ptrstart:ptrend])
+        elif csrno == 0x139:
+            self.console_putc(value & 0xFF)
+        elif csrno == HYPERCALL_CSR:
+            self.hypercall(image, value)
+
+    def guest_range(self, image, addr, length):
+        # Image offset of length bytes of guest RAM at addr, or None.
+        ofs = (addr - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+        if ofs + length > len(image):
+            return None
+        return ofs
+
+    def hypercall(self, image, op):
+        regs = self.core.regs
+        a0, a1, a2 = regs[10], regs[11], regs[12]
+        ret = 0
+        if op == HYPERCALL_COPY:
+            dst = self.guest_range(image, a0, a2)
+            src = self.guest_range(image, a1, a2)
+            if dst is None or src is None:
+                ret = HYPERCALL_EFAULT
+            elif a2:
+                image.move(dst, src, a2)
+                MINIRV32_STORE_RANGE(image, dst, a2)
+        elif op == HYPERCALL_FILL:
+            dst = self.guest_range(image, a0, a2)
+            if dst is None:
+                ret = HYPERCALL_EFAULT
+            elif a2:
+                image[dst:dst + a2] = bytes((a1 & 0xFF,)) * a2
+                MINIRV32_STORE_RANGE(image, dst, a2)
+        elif op == HYPERCALL_COMPARE:
+            first = self.guest_range(image, a0, a2)
+            second = self.guest_range(image, a1, a2)
+            if first is None or second is None:
+                ret = HYPERCALL_EFAULT
+            else:
+                a = image[first:first + a2]
+                b = image[second:second + a2]
+                ret = 0 if a == b else (0xFFFFFFFF if a < b else 1)
+        elif op == HYPERCALL_CLOCK:
+            now = time.monotonic_ns()
+            ret = now & 0xFFFFFFFF
+            regs[11] = (now >> 32) & 0xFFFFFFFF
+        elif op == HYPERCALL_WRITE:
+            buf = self.guest_range(image, a0, a1)
+            if buf is None:
+                ret = HYPERCALL_EFAULT
+            else:
+                self.console_write(image[buf:buf + a1])
+                ret = a1
+        else:
+            ret = HYPERCALL_ENOSYS
+        regs[10] = ret
+
+    def handle_other_csr_read(self, image, csrno):
+        if csrno == 0x140:
+            if not self.is_kb_hit():
+                return -1
+            return self.read_kb_byte()
+        return 0
+
+    #
+    # Running
+    #
+    def run_slice(self, limit=QUANTUM_MAX):
+        # Runs one slice of at most limit instructions, sized as described at
+        # QUANTUM_MIN, and handles what ended it.  Returns the step's return
+        # value and the number of instructions it executed, which is less than
+        # it was given when the step is cut short (QUANTUM_END, WFI, a trap).
+        core = self.core
+        time_divisor = self.time_divisor
+        this_ccount = (core.cycleh << 32) | core.cyclel
+        if self.fixed_update:
+            if self.last_time is None:
+                self.last_time = this_ccount // time_divisor
+            elapsedUs = this_ccount // time_divisor - self.last_time
+        else:
+            now = GetTimeMicroseconds()
+            if self.last_time is None:
+                self.last_time = now // time_divisor
+            elapsedUs = now // time_divisor - self.last_time
+        self.last_time += elapsedUs
+
+        if self.single_step:
+            quantum = 1
+            self.console_flush()
+            DumpState(core, self.ram)
+        else:
+            quantum = QUANTUM_MAX
+            idle = MiniRV32IMATimerDeadline(core) if core.mie & (1 << 7) else -1
+            if idle >= 0:
+                # Time passed in this step counts towards the deadline.
+                idle = max(idle - elapsedUs, 0) * time_divisor
+                quantum = idle if self.fixed_update else int(idle * self.rate * 0.75)
+            if self.keyboard_queue:
+                quantum = min(quantum, QUANTUM_IO)
+            quantum = min(max(QUANTUM_MIN, min(quantum, QUANTUM_MAX)), limit)
+
+        self.update_interrupts()
+        ret = self.step(core, self.ram, 0, elapsedUs, quantum)
+        executed = (((core.cycleh << 32) | core.cyclel) - this_ccount) & 0xFFFFFFFFFFFFFFFF
+        if self.faulted:
+            ret = 3
+        if ret == 0:
+            if not self.fixed_update:
+                spent = GetTimeMicroseconds() - now
+                if spent > 0 and executed > 0:
+                    self.rate = (self.rate * 3 + executed / spent) / 4
+            self.console_poll()
+        elif ret == 1:
+            # WFI: nothing happens until the timer deadline or, for a guest
+            # taking UART interrupts, the next key.
+            self.console_flush()
+            # A deadline already due wakes it on the next slice, without one
+            # it sleeps for IDLE_MAX_US at most.
+            idle = MiniRV32IMATimerDeadline(core)
+            if idle < 0:
+                if self.do_sleep:
+                    self.sleep(IDLE_MAX_US)
+            elif idle > 0:
+                if self.fixed_update:
+                    # Time follows the cycle count, skip it straight to the
+                    # deadline.
+                    cycles = ((core.cycleh << 32) | core.cyclel) + idle * time_divisor
+                    core.cycleh = (cycles >> 32) & 0xFFFFFFFF
+                    core.cyclel = cycles & 0xFFFFFFFF
+                elif self.do_sleep:
+                    self.sleep(min(idle * time_divisor, IDLE_MAX_US))
+        elif ret == QUANTUM_END:
+            self.console_poll()
+        elif ret == 0x5555:
+            self.console_flush()
+        elif ret != 3 and ret != 0x7777:
+            print("Unknown failure")
+        return ret, executed
+
+    def run(self, max_instructions=-1):
+        return self.run_until(None, max_instructions)
+
+    def run_until(self, predicate, max_instructions=-1):
+        # Runs until predicate(self) holds, or for max_instructions if it is
+        # not negative.  See the top of the class for the return value.
+        done = 0
+        while max_instructions < 0 or done < max_instructions:
+            if predicate is not None and predicate(self):
                 break
-            ptrend += 1
-        if ptrend != ptrstart:
-            sys.stdout.write(image[ptrstart:ptrend])
-    elif csrno == 0x139:
-        print(chr(value), end='', flush=True)
-
-def HandleOtherCSRRead(image, csrno):
-    if csrno == 0x140:
-        if not IsKBHit():
-            return -1
-        return ReadKBByte()
-    return 0
+            ret, executed = self.run_slice(QUANTUM_MAX if max_instructions < 0 else max_instructions - done)
+            if ret == 3 or ret == 0x5555:
+                return ret
+            done += executed
+        self.console_flush()
+        return None
 
 def DumpState(core, ram_image):
     pc = core.pc
     pc_offset = pc - MINIRV32_RAM_IMAGE_OFFSET
     ir = 0
     print(f"PC: {pc:08x} ", end='')
-    if 0 <= pc_offset < MINI_RV32_RAM_SIZE - 3:
+    if 0 <= pc_offset < len(ram_image) - 3:
         ir = struct.unpack('<I', ram_image[pc_offset:pc_offset+4])[0]
         print(f"[{ir:08x}] ", end='')
     else:
@@ -175,12 +1037,131 @@ def DumpState(core, ram_image):
     print(f"Z:{regs[0]:08x} ra:{regs[1]:08x} sp:{regs[2]:08x} gp:{regs[3]:08x} tp:{regs[4]:08x} t0:{regs[5]:08x} t1:{regs[6]:08x} t2:{regs[7]:08x} s0:{regs[8]:08x} s1:{regs[9]:08x} a0:{regs[10]:08x} a1:{regs[11]:08x} a2:{regs[12]:08x} a3:{regs[13]:08x} a4:{regs[14]:08x} a5:{regs[15]:08x} ", end='')
     print(f"a6:{regs[16]:08x} a7:{regs[17]:08x} s2:{regs[18]:08x} s3:{regs[19]:08x} s4:{regs[20]:08x} s5:{regs[21]:08x} s6:{regs[22]:08x} s7:{regs[23]:08x} s8:{regs[24]:08x} s9:{regs[25]:08x} s10:{regs[26]:08x} s11:{regs[27]:08x} t3:{regs[28]:08x} t4:{regs[29]:08x} t5:{regs[30]:08x} t6:{regs[31]:08x}\n")
 
-SET_HANDLERS(MINIRV32_POSTEXEC, MINIRV32_HANDLE_MEM_STORE_CONTROL, MINIRV32_HANDLE_MEM_LOAD_CONTROL, MINIRV32_OTHERCSR_WRITE, MINIRV32_OTHERCSR_READ);
+def SnapshotAlign(ofs):
+    return (ofs + SNAPSHOT_RAM_OFFSET - 1) & ~(SNAPSHOT_RAM_OFFSET - 1)
+
+def SaveSnapshot(file_name, machine, parent=None):
+    # Writes a full snapshot or, given the (file name, id) of an earlier
+    # snapshot, only the pages dirtied since that one.  Either way the dirty
+    # map starts over.  Written to a temporary file first so an interrupted
+    # write never replaces a good snapshot.  Returns the new snapshot id.
+    ram_image = machine.ram
+    snapshot_id = int.from_bytes(os.urandom(8), 'little') | 1
+    runs = []
+    parent_id = 0
+    parent_name = b''
+    if parent:
+        parent_name = os.path.relpath(parent[0], os.path.dirname(os.path.abspath(file_name))).encode()
+        parent_id = parent[1]
+        runs = list(ram_image.dirty_runs())
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(ram_image), len(runs), snapshot_id, parent_id)
+    header += machine.core.to_bytes() + machine.devices_to_bytes() + parent_name + b'\0'
+    if len(header) > SNAPSHOT_RAM_OFFSET:
+        raise ValueError(f"snapshot parent name too long: {parent[0]}")
+
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(header.ljust(SNAPSHOT_RAM_OFFSET, b'\0'))
+        if parent:
+            table = struct.pack(f'<{len(runs) * 2}I', *[n for run in runs for n in run])
+            f.write(table.ljust(SnapshotAlign(len(table)), b'\0'))
+            view = memoryview(ram_image)
+            for page, count in runs:
+                f.write(view[page << MINIRV32_DECODE_PAGE_SHIFT:(page + count) << MINIRV32_DECODE_PAGE_SHIFT])
+        else:
+            f.write(ram_image)
+    os.replace(tmp_name, file_name)
+    ram_image.clear_dirty()
+    return snapshot_id
+
+def LoadSnapshot(file_name, map_file=False, **options):
+    # Returns (machine, snapshot id), or None if the file is not a snapshot or
+    # its chain of parents is broken.  options are passed on to Machine().
+    # The chain is walked back
+    # to the full snapshot, which is read (or mapped) first, then the pages
+    # of every incremental snapshot are applied on top of it in order.
+    chain = []
+    run_counts = []
+    try:
+        while True:
+            f = open(file_name, "rb")
+            chain.append(f)
+            header = f.read(SNAPSHOT_RAM_OFFSET)
+            if len(header) != SNAPSHOT_RAM_OFFSET:
+                return None
+            magic, version, ram_amt, run_count, snapshot_id, parent_id = SNAPSHOT_HEADER.unpack_from(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                return None
+            run_counts.append(run_count)
+            if len(chain) == 1:
+                state = MiniRV32IMAState()
+                state.unpack_from(header, SNAPSHOT_HEADER.size)
+                devices = header[SNAPSHOT_HEADER.size + MINIRV32_STATE_SIZE:]
+                top_id = snapshot_id
+                top_ram_amt = ram_amt
+            elif snapshot_id != expected_id or ram_amt != top_ram_amt:
+                return None
+            if not parent_id:
+                break
+            expected_id = parent_id
+            name_start = SNAPSHOT_HEADER.size + MINIRV32_STATE_SIZE + SNAPSHOT_DEVICES.size
+            parent_name = header[name_start:header.index(b'\0', name_start)].decode()
+            file_name = os.path.join(os.path.dirname(file_name), parent_name)
+
+        ram_image = MiniRV32IMARam(ram_amt)
+        if map_file and MapFileIntoRAM(ram_image, f, SNAPSHOT_RAM_OFFSET, ram_amt):
+            pass
+        elif f.readinto(ram_image) != ram_amt:
+            return None
+        view = memoryview(ram_image)
+        for f, run_count in reversed(list(zip(chain, run_counts))[:-1]):
+            runs = struct.unpack(f'<{run_count * 2}I', f.read(run_count * 8))
+            f.seek(SNAPSHOT_RAM_OFFSET + SnapshotAlign(run_count * 8))
+            for i in range(0, len(runs), 2):
+                start = runs[i] << MINIRV32_DECODE_PAGE_SHIFT
+                end = min((runs[i] + runs[i + 1]) << MINIRV32_DECODE_PAGE_SHIFT, ram_amt)
+                if f.readinto(view[start:end]) != end - start:
+                    return None
+    finally:
+        for f in chain:
+            f.close()
+    machine = Machine(ram=ram_image, core=state, **options)
+    machine.devices_from_bytes(devices)
+    return machine, top_id
+
+def CheckpointSnapshot(file_name, machine):
+    # The first snapshot of a fresh run is a full one written to file_name.
+    # Later ones, and all of them in a restored run, only hold the pages
+    # dirtied since the snapshot before and go to the next unused
+    # file_name.1, file_name.2, ... so an existing chain is never overwritten.
+    global snapshot_parent
+    if snapshot_parent:
+        serial = 1
+        while os.path.exists(f"{file_name}.{serial}"):
+            serial += 1
+        file_name = f"{file_name}.{serial}"
+    snapshot_parent = (file_name, SaveSnapshot(file_name, machine, snapshot_parent))
+
+def RequestSnapshot(signum, frame):
+    # Taken by the main loop between two steps.
+    global snapshot_requested
+    snapshot_requested = True
+
+def WriteStdout(data):
+    sys.stdout.flush()
+    if hasattr(sys.stdout, "buffer"):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        sys.stdout.write(data.decode("latin-1"))
+        sys.stdout.flush()
 
 # Main function
-def main(argv):
-    global core
-    global fail_on_all_faults
+def main(argv, use_keyboard=True):
+    global snapshot_requested
+    global snapshot_parent
+    snapshot_requested = False
+    snapshot_parent = None
     ram_amt = MINI_RV32_RAM_SIZE
     instct = -1
     show_help = 0
@@ -188,10 +1169,22 @@ def main(argv):
     fixed_update = 0
     do_sleep = 1
     single_step = 0
-    dtb_ptr = 0
+    use_blocks = 0
+    fail_on_all_faults = 0
     image_file_name = None
     dtb_file_name = None
     kernel_command_line = None
+    snapshot_file_name = None
+    restore_file_name = None
+    snapshot_interval = 0
+    map_image = 0
+    input_file_name = None
+    profile_prefix = None
+    symbol_file_name = None
+    trace_file_name = None
+    console_file_name = None
+    disk_file_name = None
+    cache_dir = None
 
     image_file_name = "Image"
 
@@ -201,34 +1194,71 @@ def main(argv):
         param_continue = 0
         while True:
             if param[0] == '-' or param_continue:
-                if param[1] == 'm':
+                opt = param[1:2]
+                if opt == 'm':
                     i += 1
                     ram_amt = SimpleReadNumberInt(argv[i], ram_amt)
-                elif param[1] == 'c':
+                elif opt == 'c':
                     i += 1
                     instct = SimpleReadNumberInt(argv[i], -1)
-                elif param[1] == 'k':
+                elif opt == 'k':
                     i += 1
                     kernel_command_line = argv[i]
-                elif param[1] == 'f':
+                elif opt == 'f':
                     i += 1
                     image_file_name = argv[i]
-                elif param[1] == 'b':
+                elif opt == 'b':
                     i += 1
                     dtb_file_name = argv[i]
-                elif param[1] == 'l':
+                elif opt == 'l':
                     param_continue = 1
                     fixed_update = 1
-                elif param[1] == 'p':
+                elif opt == 'p':
                     param_continue = 1
                     do_sleep = 0
-                elif param[1] == 's':
+                elif opt == 's':
                     param_continue = 1
                     single_step = 1
-                elif param[1] == 'd':
+                elif opt == 'd':
                     param_continue = 1
                     fail_on_all_faults = 1
-                elif param[1] == 't':
+                elif opt == 'j':
+                    param_continue = 1
+                    use_blocks = 1
+                elif opt == 'I':
+                    i += 1
+                    input_file_name = argv[i]
+                elif opt == 'g':
+                    i += 1
+                    profile_prefix = argv[i]
+                elif opt == 'y':
+                    i += 1
+                    symbol_file_name = argv[i]
+                elif opt == 'T':
+                    i += 1
+                    trace_file_name = argv[i]
+                elif opt == 'C':
+                    i += 1
+                    cache_dir = argv[i]
+                elif opt == 'o':
+                    i += 1
+                    console_file_name = argv[i]
+                elif opt == 'D':
+                    i += 1
+                    disk_file_name = argv[i]
+                elif opt == 'M':
+                    param_continue = 1
+                    map_image = 1
+                elif opt == 'w':
+                    i += 1
+                    snapshot_file_name = argv[i]
+                elif opt == 'r':
+                    i += 1
+                    restore_file_name = argv[i]
+                elif opt == 'i':
+                    i += 1
+                    snapshot_interval = SimpleReadNumberInt(argv[i], 0)
+                elif opt == 't':
                     i += 1
                     time_divisor = SimpleReadNumberInt(argv[i], 1)
                 else:
@@ -246,15 +1276,50 @@ def main(argv):
         i += 1
 
     if show_help or image_file_name is None or time_divisor <= 0:
-        print("./mini-rv32imaf [parameters]\n\t-m [ram amount]\n\t-f [running image]\n\t-k [kernel command line]\n\t-b [dtb file, or 'disable']\n\t-c instruction count\n\t-s single step with full processor state\n\t-t time divion base\n\t-l lock time base to instruction count\n\t-p disable sleep when wfi\n\t-d fail out immediately on all faults\n")
+        print("./mini-rv32imaf [parameters]\n\t-m [ram amount]\n\t-f [running image]\n\t-k [kernel command line]\n\t-b [dtb file, or 'disable']\n\t-c instruction count\n\t-s single step with full processor state\n\t-t time divion base\n\t-l lock time base to instruction count\n\t-p disable sleep when wfi\n\t-d fail out immediately on all faults\n\t-j run through the basic block translator\n\t-C [directory] keep translated blocks there for later runs\n\t-w [snapshot file] written at the end of the instruction count and on SIGUSR1\n\t-r [snapshot file] restore and resume\n\t-i [instruction count] also write incremental snapshots this often\n\t-M map the image or snapshot copy-on-write instead of reading it\n\t-I [input file] typed in instead of the keyboard\n\t-g [output prefix] profile guest code into prefix.txt and prefix.folded\n\t-y [System.map or ELF file] symbols for the profile\n\t-T [trace file] trace the last instructions, traps, MMIO and CSR accesses\n\t-o [file or pipe] console output, instead of stdout\n\t-D [disk image] backing the virtio block device\n")
         return 1
 
-    ram_image = bytearray(ram_amt)
-    if not ram_image:
-        print("Error: could not allocate system image.")
-        return -4
+    console_file = open(console_file_name, "wb", buffering=0) if console_file_name else None
 
-    while True:
+    input_script = None
+    if input_file_name:
+        try:
+            with open(input_file_name, "rb") as f:
+                input_script = f.read()
+        except FileNotFoundError:
+            print(f"Error: \"{input_file_name}\" not found")
+            return -5
+
+    disk = None
+    if disk_file_name:
+        try:
+            disk = OpenDisk(disk_file_name)
+        except FileNotFoundError:
+            print(f"Error: \"{disk_file_name}\" not found")
+            return -5
+        except ValueError:
+            print(f"Error: \"{disk_file_name}\" is empty")
+            return -11
+
+    translation_cache = MiniRV32IMATranslationCache(cache_dir) if cache_dir else None
+    options = dict(console=console_file.write if console_file else WriteStdout, disk=disk,
+                   use_blocks=use_blocks and not profile_prefix, time_divisor=time_divisor,
+                   fixed_update=fixed_update, do_sleep=do_sleep, single_step=single_step,
+                   fail_on_all_faults=fail_on_all_faults,
+                   translation_cache=translation_cache)
+
+    if restore_file_name:
+        try:
+            snapshot = LoadSnapshot(restore_file_name, map_image, **options)
+        except FileNotFoundError:
+            print(f"Error: \"{restore_file_name}\" not found")
+            return -5
+        if snapshot is None:
+            print(f"Error: \"{restore_file_name}\" is not a snapshot")
+            return -10
+        machine, snapshot_id = snapshot
+        snapshot_parent = (restore_file_name, snapshot_id)
+    else:
         try:
             with open(image_file_name, "rb") as f:
                 f.seek(0, os.SEEK_END)
@@ -264,92 +1329,168 @@ def main(argv):
                     print(f"Error: Could not fit RAM image ({flen} bytes) into {ram_amt}")
                     return -6
 
-                ram_image = bytearray(ram_amt)
-                if f.readinto(ram_image) != flen:
+                machine = Machine(ram_amt, **options)
+                if map_image and MapFileIntoRAM(machine.ram, f, 0, flen):
+                    pass
+                elif f.readinto(machine.ram) != flen:
                     print("Error: Could not load image.")
                     return -7
-
-                if dtb_file_name:
-                    if dtb_file_name == "disable":
-                        pass
-                    else:
-                        with open(dtb_file_name, "rb") as f:
-                            f.seek(0, os.SEEK_END)
-                            dtblen = f.tell()
-                            f.seek(0, os.SEEK_SET)
-                            #sys.getsizeof(MiniRV32IMAState)
-                            state_size = 192
-                            dtb_ptr = ram_amt - dtblen - state_size
-                            if f.readinto(ram_image[dtb_ptr:]) != dtblen:
-                                print(f"Error: Could not open dtb \"{dtb_file_name}\"")
-                                return -9
-                else:
-                    #sys.getsizeof(MiniRV32IMAState)
-                    state_size = 192
-                    mbdtb_size = len(default64mbdtb)
-                    dtb_ptr = ram_amt - mbdtb_size - state_size
-                    ram_image[dtb_ptr:dtb_ptr+mbdtb_size] = default64mbdtb
-                    if kernel_command_line:
-                        ram_image[dtb_ptr+0xc0:dtb_ptr+0xc0+len(kernel_command_line)] = kernel_command_line.encode()
-
-                break
         except FileNotFoundError:
             print(f"Error: \"{image_file_name}\" not found")
             return -5
 
-    CaptureKeyboardInput()
+        if dtb_file_name == "disable":
+            pass
+        elif dtb_file_name:
+            try:
+                with open(dtb_file_name, "rb") as f:
+                    machine.load_dtb(f.read())
+            except OSError:
+                print(f"Error: Could not open dtb \"{dtb_file_name}\"")
+                return -9
+        else:
+            machine.load_dtb(None, kernel_command_line)
+
+    if input_script is not None:
+        machine.send(input_script)
+    elif use_keyboard:
+        CaptureKeyboardInput(machine)
 
-    core = MiniRV32IMAState()
-    core.pc = MINIRV32_RAM_IMAGE_OFFSET
-    core.regs[10] = 0x00
-    core.regs[11] = (dtb_ptr+MINIRV32_RAM_IMAGE_OFFSET) if dtb_ptr else 0
-    core.extraflags |= 3
+    profiler = None
+    if profile_prefix:
+        profiler = MiniRV32IMAProfiler()
+        profiler.start(machine.ram)
 
-    if dtb_file_name is None:
-        ptr = dtb_ptr + 0x13c
-        dtb = struct.unpack('<I', ram_image[ptr:ptr+4])[0]
-        if dtb == 0x00c0ff03:
-            validram = dtb_ptr
-            ram_image[ptr] =     validram >> 24 & 0xFF
-            ram_image[ptr + 1] = validram >> 16 & 0xFF
-            ram_image[ptr + 2] = validram >> 8  & 0xFF
-            ram_image[ptr + 3] = validram       & 0xFF
+    tracer = None
+    if trace_file_name:
+        tracer = MiniRV32IMATracer()
+        tracer.start(machine.ram)
+
+    if snapshot_file_name and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, RequestSnapshot)
 
     rt = 0
-    lastTime = 0 if fixed_update else GetTimeMicroseconds() // time_divisor
-    instrs_per_flip = 1 if single_step else 1024
-    while rt < instct + 1 or instct < 0:
-        this_ccount = core.cyclel
-        elapsedUs = 0
-        if fixed_update:
-            elapsedUs = this_ccount // time_divisor - lastTime
-        else:
-            elapsedUs = GetTimeMicroseconds() // time_divisor - lastTime
-        lastTime += elapsedUs
+    faulted = False
+    next_snapshot = snapshot_interval if snapshot_file_name and snapshot_interval > 0 else -1
+    core = machine.core
+    try:
+        while rt < instct + 1 or instct < 0:
+            if snapshot_requested or 0 <= next_snapshot <= rt:
+                if snapshot_requested:
+                    snapshot_requested = False
+                else:
+                    next_snapshot = rt + snapshot_interval
+                CheckpointSnapshot(snapshot_file_name, machine)
 
-        if single_step:
-            DumpState(core, ram_image)
+            limit = QUANTUM_MAX
+            if instct >= 0:
+                limit = min(limit, instct + 1 - rt)
+            if next_snapshot >= 0:
+                limit = min(limit, next_snapshot - rt)
 
-        ret = MiniRV32IMAStep(core, ram_image, 0, elapsedUs, instrs_per_flip)
-        if ret == 0:
-            pass
-        elif ret == 1:
-            if do_sleep:
-                MiniSleep()
-            this_ccount += instrs_per_flip
-        elif ret == 3:
-            instct = 0
-        elif ret == 0x7777:
-            continue
-        elif ret == 0x5555:
-            print(f"POWEROFF@0x{core.cycleh:08x}{core.cyclel:08x}")
-            return 0
+            ret, executed = machine.run_slice(limit)
+            if ret == 3:
+                faulted = True
+                instct = 0
+            elif ret == 0x7777:
+                continue
+            elif ret == 0x5555:
+                machine.host_message(f"POWEROFF@0x{core.cycleh:08x}{core.cyclel:08x}")
+                return 0
+
+            rt += executed
+
+        machine.console_flush()
+        DumpState(core, machine.ram)
+        if snapshot_file_name:
+            CheckpointSnapshot(snapshot_file_name, machine)
+        if faulted:
+            return 3
+    finally:
+        machine.console_flush()
+        if console_file:
+            console_file.close()
+        if profiler:
+            profiler.stop(machine.ram)
+            profiler.write(profile_prefix, symbol_file_name)
+        if tracer:
+            tracer.stop(machine.ram)
+            tracer.write(trace_file_name)
+        if translation_cache:
+            translation_cache.save()
+
+def RunGuest(argv):
+    # Runs one guest of a fleet: main() with the given arguments, input only
+    # from its -I script and everything it prints collected.  Returns (main's
+    # return value, console output).
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        ret = main(["mini_rv32ima.py"] + argv, use_keyboard=False)
+    return ret, output.getvalue()
+
+# Fleet entry point: runs many independent guests, one per worker process.
+# Every line of the job file holds the arguments of one guest, as they would be
+# given to main().  Prints a status line per guest and its console output, or
+# writes the output to [output dir]/[job number].log.  A guest powering off or
+# running out of its -c instruction count is done; one stopped by a fault (-d),
+# failing otherwise or crashing its worker fails the fleet.
+def fleet(argv):
+    workers = os.cpu_count()
+    output_dir = None
+    job_file_name = None
+
+    i = 1
+    while i < len(argv):
+        if argv[i] == '-n' and i + 1 < len(argv):
+            i += 1
+            workers = SimpleReadNumberInt(argv[i], workers)
+        elif argv[i] == '-o' and i + 1 < len(argv):
+            i += 1
+            output_dir = argv[i]
+        elif argv[i][0] != '-' and job_file_name is None:
+            job_file_name = argv[i]
         else:
-            print("Unknown failure")
+            job_file_name = None
+            break
+        i += 1
 
-        rt += instrs_per_flip
+    if job_file_name is None or workers <= 0:
+        print("./mini-rv32imaf fleet [parameters] [job file]\n\t-n [number of worker processes]\n\t-o [output directory]\n")
+        return 1
 
-    DumpState(core, ram_image)
+    jobs = []
+    with open(job_file_name, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                jobs.append(shlex.split(line))
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = [pool.submit(RunGuest, job) for job in jobs]
+        for n, result in enumerate(results):
+            try:
+                ret, output = result.result()
+            except Exception as e:
+                ret, output = None, f"{type(e).__name__}: {e}\n"
+                status = "crashed"
+            else:
+                status = "POWEROFF" if ret == 0 else "stopped" if ret is None else "FAULT" if ret == 3 else f"failed ({ret})"
+            if status != "POWEROFF" and status != "stopped":
+                failures += 1
+
+            print(f"guest {n}: {status}")
+            if output_dir:
+                with open(os.path.join(output_dir, f"{n}.log"), "w") as f:
+                    f.write(output)
+            else:
+                print(output)
+    return 1 if failures else 0
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "fleet":
+        sys.exit(fleet(sys.argv[1:]))
     main(sys.argv)
\ No newline at end of file
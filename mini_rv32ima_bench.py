@@ -0,0 +1,395 @@
+import os
+import sys
+import json
+import time
+import struct
+import platform
+from mini_rv32ima_decoder import *
+from mini_rv32ima_translator import MiniRV32IMAStepBlocks
+
+# Benchmark suite.
+# Runs synthetic guest programs, each stressing one part of the emulator, for
+# a fixed number of instructions and reports emulated MIPS.  The programs are
+# built with the small encoder below so no cross toolchain is needed.  If a
+# kernel Image is present, it also measures the time from reset to the shell
+# prompt.  Results can be written as JSON to compare runs over time.
+
+BENCH_DATA = 0x80100000
+BENCH_RAM_SIZE = 4 * 1024 * 1024
+
+#
+# Instruction encoder
+#
+def EncodeR(funct7, rs2, rs1, funct3, rd, opcode):
+    return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+def EncodeI(imm, rs1, funct3, rd, opcode):
+    return ((imm & 0xFFF) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+def EncodeS(imm, rs2, rs1, funct3, opcode):
+    return ((imm >> 5 & 0x7F) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | ((imm & 0x1F) << 7) | opcode
+
+def EncodeB(imm, rs2, rs1, funct3):
+    return ((imm >> 12 & 1) << 31) | ((imm >> 5 & 0x3F) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | ((imm >> 1 & 0xF) << 8) | ((imm >> 11 & 1) << 7) | 0x63
+
+def EncodeJ(imm, rd):
+    return ((imm >> 20 & 1) << 31) | ((imm >> 1 & 0x3FF) << 21) | ((imm >> 11 & 1) << 20) | ((imm >> 12 & 0xFF) << 12) | (rd << 7) | 0x6F
+
+ALU_FUNCT3 = {'add': 0, 'sll': 1, 'slt': 2, 'sltu': 3, 'xor': 4, 'srl': 5, 'or': 6, 'and': 7}
+ALUI_FUNCT3 = {'addi': 0, 'slli': 1, 'slti': 2, 'sltiu': 3, 'xori': 4, 'srli': 5, 'srai': 5, 'ori': 6, 'andi': 7}
+MUL_FUNCT3 = {'mul': 0, 'mulh': 1, 'mulhsu': 2, 'mulhu': 3, 'div': 4, 'divu': 5, 'rem': 6, 'remu': 7}
+AMO_FUNCT5 = {'amoadd': 0x00, 'amoswap': 0x01, 'lr': 0x02, 'sc': 0x03, 'amoxor': 0x04, 'amoor': 0x08, 'amoand': 0x0C, 'amomin': 0x10, 'amomax': 0x14, 'amominu': 0x18, 'amomaxu': 0x1C}
+BRANCH_FUNCT3 = {'beq': 0, 'bne': 1, 'blt': 4, 'bge': 5, 'bltu': 6, 'bgeu': 7}
+LOAD_FUNCT3 = {'lb': 0, 'lh': 1, 'lw': 2, 'lbu': 4, 'lhu': 5}
+STORE_FUNCT3 = {'sb': 0, 'sh': 1, 'sw': 2}
+CSR_FUNCT3 = {'csrrw': 1, 'csrrs': 2, 'csrrc': 3, 'csrrwi': 5, 'csrrsi': 6, 'csrrci': 7}
+
+# A program is a list of words; branch and jump targets are label names
+# resolved by assemble().
+class BenchProgram:
+    def __init__(self):
+        self.code = []
+        self.labels = {}
+        self.fixups = []
+
+    def label(self, name):
+        self.labels[name] = len(self.code)
+
+    def alu(self, op, rd, rs1, rs2):
+        funct7 = 0x20 if op in ('sub', 'sra') else 0
+        self.code.append(EncodeR(funct7, rs2, rs1, ALU_FUNCT3[{'sub': 'add', 'sra': 'srl'}.get(op, op)], rd, 0x33))
+
+    def alui(self, op, rd, rs1, imm):
+        if op in ('slli', 'srli', 'srai'):
+            imm = (imm & 0x1F) | (0x400 if op == 'srai' else 0)
+        self.code.append(EncodeI(imm, rs1, ALUI_FUNCT3[op], rd, 0x13))
+
+    def mul(self, op, rd, rs1, rs2):
+        self.code.append(EncodeR(1, rs2, rs1, MUL_FUNCT3[op], rd, 0x33))
+
+    def amo(self, op, rd, rs1, rs2=0):
+        self.code.append(EncodeR(AMO_FUNCT5[op] << 2, rs2, rs1, 2, rd, 0x2F))
+
+    def load(self, op, rd, rs1, imm):
+        self.code.append(EncodeI(imm, rs1, LOAD_FUNCT3[op], rd, 0x03))
+
+    def store(self, op, rs2, rs1, imm):
+        self.code.append(EncodeS(imm, rs2, rs1, STORE_FUNCT3[op], 0x23))
+
+    def csr(self, op, rd, csrno, rs1):
+        self.code.append(EncodeI(csrno, rs1, CSR_FUNCT3[op], rd, 0x73))
+
+    def li(self, rd, value):
+        value &= 0xFFFFFFFF
+        low = ((value & 0xFFF) ^ 0x800) - 0x800
+        self.code.append((((value - low) & 0xFFFFF000)) | (rd << 7) | 0x37)
+        self.alui('addi', rd, rd, low)
+
+    def branch(self, op, rs1, rs2, target):
+        self.fixups.append((len(self.code), target, lambda imm: EncodeB(imm, rs2, rs1, BRANCH_FUNCT3[op])))
+        self.code.append(0)
+
+    def jump(self, target, rd=0):
+        self.fixups.append((len(self.code), target, lambda imm: EncodeJ(imm, rd)))
+        self.code.append(0)
+
+    def assemble(self):
+        for at, target, encode in self.fixups:
+            self.code[at] = encode((self.labels[target] - at) * 4)
+        return struct.pack(f'<{len(self.code)}I', *self.code)
+
+#
+# Programs.  Each one runs forever; registers x5 and up are scratch.
+#
+def ProgramALU():
+    p = BenchProgram()
+    p.li(6, 0x12345678)
+    p.label('top')
+    p.alu('add', 5, 5, 6)
+    p.alu('xor', 7, 5, 6)
+    p.alu('sll', 8, 7, 6)
+    p.alui('srli', 9, 8, 3)
+    p.alu('sub', 6, 6, 9)
+    p.alu('or', 10, 9, 5)
+    p.alu('and', 11, 10, 7)
+    p.alu('slt', 12, 11, 5)
+    p.alu('sra', 13, 10, 12)
+    p.alui('addi', 14, 14, 1)
+    p.alu('sltu', 15, 14, 6)
+    p.jump('top')
+    return p
+
+def ProgramLoadStore():
+    p = BenchProgram()
+    p.li(20, BENCH_DATA)
+    p.label('outer')
+    p.alui('addi', 22, 20, 0)
+    p.alui('addi', 21, 0, 1024)
+    p.label('inner')
+    p.load('lw', 5, 22, 0)
+    p.alui('addi', 5, 5, 1)
+    p.store('sw', 5, 22, 0)
+    p.load('lbu', 6, 22, 1)
+    p.store('sh', 6, 22, 6)
+    p.load('lh', 7, 22, 6)
+    p.store('sb', 7, 22, 5)
+    p.alui('addi', 22, 22, 8)
+    p.alui('addi', 21, 21, -1)
+    p.branch('bne', 21, 0, 'inner')
+    p.jump('outer')
+    return p
+
+def ProgramBranch():
+    p = BenchProgram()
+    p.label('top')
+    p.alui('addi', 5, 5, 1)
+    p.alui('andi', 6, 5, 1)
+    p.branch('beq', 6, 0, 'a')
+    p.alui('addi', 7, 7, 1)
+    p.label('a')
+    p.alui('andi', 8, 5, 2)
+    p.branch('bne', 8, 0, 'b')
+    p.alui('addi', 9, 9, 1)
+    p.label('b')
+    p.branch('blt', 5, 7, 'c')
+    p.alui('addi', 10, 10, 1)
+    p.label('c')
+    p.branch('bgeu', 9, 10, 'd')
+    p.alui('addi', 11, 11, 1)
+    p.label('d')
+    p.branch('bge', 11, 9, 'top')
+    p.jump('top')
+    return p
+
+def ProgramMulDiv():
+    p = BenchProgram()
+    p.li(5, 1)
+    p.label('top')
+    p.alui('addi', 5, 5, 7)
+    p.mul('mul', 6, 5, 5)
+    p.mul('mulh', 7, 6, 5)
+    p.mul('mulhu', 8, 6, 7)
+    p.mul('mulhsu', 9, 7, 6)
+    p.mul('div', 10, 6, 5)
+    p.mul('divu', 11, 6, 5)
+    p.mul('rem', 12, 6, 5)
+    p.mul('remu', 13, 6, 5)
+    p.jump('top')
+    return p
+
+def ProgramAMO():
+    p = BenchProgram()
+    p.li(20, BENCH_DATA)
+    p.label('top')
+    p.amo('amoadd', 5, 20, 6)
+    p.amo('amoswap', 7, 20, 5)
+    p.amo('amoor', 8, 20, 7)
+    p.amo('amomaxu', 9, 20, 6)
+    p.amo('lr', 10, 20)
+    p.alui('addi', 10, 10, 1)
+    p.amo('sc', 11, 20, 10)
+    p.alui('addi', 6, 6, 1)
+    p.jump('top')
+    return p
+
+def ProgramCSR():
+    p = BenchProgram()
+    p.label('top')
+    p.csr('csrrs', 5, 0xC00, 0)    # cycle
+    p.csr('csrrw', 0, 0x340, 5)    # mscratch
+    p.csr('csrrs', 6, 0x340, 0)
+    p.csr('csrrc', 0, 0x340, 6)
+    p.csr('csrrsi', 7, 0x300, 0)   # mstatus
+    p.csr('csrrs', 8, 0xf11, 0)    # mvendorid
+    p.alui('addi', 9, 9, 1)
+    p.jump('top')
+    return p
+
+def ProgramMMIO():
+    p = BenchProgram()
+    p.li(20, 0x10000000)
+    p.li(21, 0x1100c000)
+    p.label('top')
+    p.load('lbu', 5, 20, 5)        # UART line status
+    p.alui('andi', 5, 5, 0x20)
+    p.branch('beq', 5, 0, 'top')
+    p.store('sb', 6, 20, 0)        # UART data
+    p.load('lw', 7, 21, -8)        # CLINT timer
+    p.alui('addi', 6, 6, 1)
+    p.jump('top')
+    return p
+
+def ProgramMemOps():
+    # The loops memset, memcpy and strlen compile to.
+    p = BenchProgram()
+    p.li(20, BENCH_DATA)
+    p.li(21, BENCH_DATA + 0x4000)
+    p.li(22, BENCH_DATA + 0x8000)
+    p.alui('addi', 6, 0, 0x5a)
+    p.label('top')
+    p.alui('addi', 5, 20, 0)
+    p.label('memset')
+    p.store('sw', 6, 5, 0)
+    p.alui('addi', 5, 5, 4)
+    p.branch('bne', 5, 21, 'memset')
+    p.store('sb', 0, 20, 0x3ff)
+    p.alui('addi', 5, 20, 0)
+    p.alui('addi', 7, 21, 0)
+    p.label('memcpy')
+    p.load('lbu', 8, 5, 0)
+    p.store('sb', 8, 7, 0)
+    p.alui('addi', 5, 5, 1)
+    p.alui('addi', 7, 7, 1)
+    p.branch('bltu', 7, 22, 'memcpy')
+    p.alui('addi', 5, 21, 0)
+    p.label('strlen')
+    p.load('lbu', 8, 5, 0)
+    p.alui('addi', 5, 5, 1)
+    p.branch('bne', 8, 0, 'strlen')
+    p.jump('top')
+    return p
+
+BENCH_PROGRAMS = [
+    ('alu', ProgramALU),
+    ('loadstore', ProgramLoadStore),
+    ('branch', ProgramBranch),
+    ('muldiv', ProgramMulDiv),
+    ('amo', ProgramAMO),
+    ('csr', ProgramCSR),
+    ('mmio', ProgramMMIO),
+    ('memops', ProgramMemOps),
+]
+
+BENCH_ENGINES = {'step': MiniRV32IMAStep, 'blocks': MiniRV32IMAStepBlocks}
+
+# Stand-in platform: the UART is always ready, stores go nowhere.
+def BenchPostExec(pc, ir, retval):
+    return retval
+
+def BenchStoreControl(addy, val):
+    return 0
+
+def BenchLoadControl(addy):
+    return 0x60 if addy == 0x10000005 else 0
+
+def BenchCSRWrite(image, csrno, value):
+    pass
+
+def BenchCSRRead(image, csrno):
+    return 0
+
+def RunProgram(program, step, instructions, instrs_per_flip=1024):
+    # Returns (instructions retired, seconds).
+    image = MiniRV32IMARam(BENCH_RAM_SIZE)
+    SET_HANDLERS(image, BenchPostExec, BenchStoreControl, BenchLoadControl, BenchCSRWrite, BenchCSRRead)
+    code = program().assemble()
+    image[0:len(code)] = code
+    state = MiniRV32IMAState()
+    state.pc = MINIRV32_RAM_IMAGE_OFFSET
+    state.extraflags |= 3
+
+    start = time.perf_counter()
+    done = 0
+    while done < instructions:
+        step(state, image, 0, 0, instrs_per_flip)
+        done = (state.cycleh << 32) | state.cyclel
+    return done, time.perf_counter() - start
+
+def RunBoot(image_file_name, prompt, use_blocks):
+    # Boots the Image on a Machine until its console output ends with the
+    # prompt.  Returns (instructions retired, seconds), or None if the guest
+    # stopped before reaching it.  The count is exact to within the slice
+    # that printed the prompt.
+    from mini_rv32ima import Machine
+    with open(image_file_name, "rb") as f:
+        image = f.read()
+    machine = Machine(use_blocks=use_blocks)
+    machine.load_image(image)
+    machine.load_dtb()
+    prompt = prompt.encode()
+    start = time.perf_counter()
+    if machine.run_until(lambda m: m.output.endswith(prompt)) is not None:
+        return None
+    core = machine.core
+    return (core.cycleh << 32) | core.cyclel, time.perf_counter() - start
+
+def main(argv):
+    instructions = 2000000
+    repeat = 3
+    engines = list(BENCH_ENGINES)
+    only = None
+    image_file_name = "Image"
+    prompt = "# "
+    json_file_name = None
+    show_help = 0
+
+    i = 1
+    while i < len(argv):
+        param = argv[i]
+        if i + 1 < len(argv) and param in ('-n', '-r', '-e', '-b', '-f', '-P', '-o'):
+            i += 1
+            value = argv[i]
+            if param == '-n':
+                instructions = int(value, 0)
+            elif param == '-r':
+                repeat = int(value, 0)
+            elif param == '-e':
+                engines = value.split(',')
+            elif param == '-b':
+                only = value.split(',')
+            elif param == '-f':
+                image_file_name = value
+            elif param == '-P':
+                prompt = value
+            elif param == '-o':
+                json_file_name = value
+        else:
+            show_help = 1
+        i += 1
+
+    names = [name for name, program in BENCH_PROGRAMS] + ['boot']
+    if show_help or repeat <= 0 or any(e not in BENCH_ENGINES for e in engines) or (only and any(b not in names for b in only)):
+        print(f"./mini_rv32ima_bench.py [parameters]\n\t-n instructions per run (default {instructions})\n\t-r runs per benchmark, the best counts (default {repeat})\n\t-e engines, of {','.join(BENCH_ENGINES)}\n\t-b benchmarks, of {','.join(names)}\n\t-f [kernel image for the boot benchmark]\n\t-P [shell prompt ending the boot benchmark]\n\t-o [JSON output file]\n")
+        return 1
+
+    results = []
+    for engine in engines:
+        for name, program in BENCH_PROGRAMS:
+            if only and name not in only:
+                continue
+            runs = [RunProgram(program, BENCH_ENGINES[engine], instructions) for r in range(repeat)]
+            done, seconds = min(runs, key=lambda run: run[1] / run[0])
+            results.append({'benchmark': name, 'engine': engine, 'instructions': done, 'seconds': seconds, 'mips': done / seconds / 1e6})
+            print(f"{name:<10} {engine:<7} {done / seconds / 1e6:8.3f} MIPS")
+
+        if not only or 'boot' in only:
+            result = {'benchmark': 'boot', 'engine': engine}
+            if not os.path.exists(image_file_name):
+                print(f"{'boot':<10} {engine:<7} skipped, no \"{image_file_name}\"")
+                result['skipped'] = True
+            else:
+                boot = RunBoot(image_file_name, prompt, engine == 'blocks')
+                if boot is None:
+                    print(f"{'boot':<10} {engine:<7} stopped before the prompt")
+                    result['skipped'] = True
+                else:
+                    done, seconds = boot
+                    result.update({'instructions': done, 'seconds': seconds, 'mips': done / seconds / 1e6})
+                    print(f"{'boot':<10} {engine:<7} {done / seconds / 1e6:8.3f} MIPS, {seconds:.1f} s to the prompt")
+            results.append(result)
+
+    if json_file_name:
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_implementation() + ' ' + platform.python_version(),
+            'platform': platform.platform(),
+            'instructions': instructions,
+            'repeat': repeat,
+            'results': results,
+        }
+        with open(json_file_name, "w") as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,84 +1,867 @@
-import ctypes
+import mmap
 import struct
 
 # Constants
-MINI_RV32_RAM_SIZE = 0x80000000
 MINIRV32_RAM_IMAGE_OFFSET = 0x80000000
 
 INT32_MIN=0x80000000
 
-MINIRV32_POSTEXEC = None
-MINIRV32_HANDLE_MEM_STORE_CONTROL = None
-MINIRV32_HANDLE_MEM_LOAD_CONTROL  = None
-MINIRV32_OTHERCSR_WRITE = None
-MINIRV32_OTHERCSR_READ = None
-
-def SET_RAM_SIZE(size):
-    global MINI_RV32_RAM_SIZE;
-    MINI_RV32_RAM_SIZE = size
-
-def SET_HANDLERS(MINIRV32_POSTEXEC_, MINIRV32_HANDLE_MEM_STORE_CONTROL_, MINIRV32_HANDLE_MEM_LOAD_CONTROL_, MINIRV32_OTHERCSR_WRITE_, MINIRV32_OTHERCSR_READ_):
-    global MINIRV32_POSTEXEC, MINIRV32_HANDLE_MEM_STORE_CONTROL, MINIRV32_HANDLE_MEM_LOAD_CONTROL, MINIRV32_OTHERCSR_WRITE, MINIRV32_OTHERCSR_READ
-    MINIRV32_POSTEXEC, MINIRV32_HANDLE_MEM_STORE_CONTROL, MINIRV32_HANDLE_MEM_LOAD_CONTROL, MINIRV32_OTHERCSR_WRITE, MINIRV32_OTHERCSR_READ = MINIRV32_POSTEXEC_, MINIRV32_HANDLE_MEM_STORE_CONTROL_, MINIRV32_HANDLE_MEM_LOAD_CONTROL_, MINIRV32_OTHERCSR_WRITE_, MINIRV32_OTHERCSR_READ_
-
-if 0:
-    def LOG(x): print(x)
-else:
-    def LOG(x): pass
-
-def MINIRV32_MMIO_RANGE(n):
-    return 0x10000000 <= n < 0x12000000
+# Signed/unsigned reinterpretation of 32 bit values with plain ints.
+# Registers hold uint32_t values; a signed compare of two of them is a compare
+# with the sign bits flipped, (a ^ 0x80000000) < (b ^ 0x80000000), which the
+# handlers use inline.
+def MINIRV32_SIGNED(x):
+    # (int32_t)x
+    return ((x & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+
+def MINIRV32_UNSIGNED(x):
+    # (uint32_t)x
+    return x & 0xFFFFFFFF
+
+# RV32M operations on signed operands, with the results of the C original:
+# division truncates toward zero and overflow/divide by zero do not trap.
+def MINIRV32_MULH(a, b):
+    return ((MINIRV32_SIGNED(a) * MINIRV32_SIGNED(b)) >> 32) & 0xFFFFFFFF
+
+def MINIRV32_MULHSU(a, b):
+    return ((MINIRV32_SIGNED(a) * b) >> 32) & 0xFFFFFFFF
+
+def MINIRV32_DIV(a, b):
+    if b == 0:
+        return 0xFFFFFFFF #-1
+    if a == INT32_MIN and b == 0xFFFFFFFF:
+        return a
+    a = MINIRV32_SIGNED(a)
+    b = MINIRV32_SIGNED(b)
+    q = abs(a) // abs(b)
+    return (-q if (a < 0) != (b < 0) else q) & 0xFFFFFFFF
+
+def MINIRV32_REM(a, b):
+    if b == 0:
+        return a
+    if a == INT32_MIN and b == 0xFFFFFFFF:
+        return 0
+    a = MINIRV32_SIGNED(a)
+    r = abs(a) % abs(MINIRV32_SIGNED(b))
+    return (-r if a < 0 else r) & 0xFFFFFFFF
+
+# Platform hooks.  They belong to the machine an image is the RAM of and are
+# kept on the image (see MiniRV32IMARam), which every handler is given, so
+# machines in one process do not share anything.
+# Every load and store outside RAM goes to the control hooks, which raise
+# MiniRV32IMATrap for addresses no device answers to.  A store hook returns 0,
+# or a value to end the step with.  postexec(pc, ir, trap) is called when an
+# instruction traps and returns the trap to take, or 0 to end the step at the
+# instruction instead.
+def SET_HANDLERS(image, MINIRV32_POSTEXEC_, MINIRV32_HANDLE_MEM_STORE_CONTROL_, MINIRV32_HANDLE_MEM_LOAD_CONTROL_, MINIRV32_OTHERCSR_WRITE_, MINIRV32_OTHERCSR_READ_):
+    image.postexec = MINIRV32_POSTEXEC_
+    image.mem_handlers = (MINIRV32_HANDLE_MEM_STORE_CONTROL_, MINIRV32_HANDLE_MEM_LOAD_CONTROL_)
+    image.othercsr_write = MINIRV32_OTHERCSR_WRITE_
+    image.othercsr_read = MINIRV32_OTHERCSR_READ_
+    MINIRV32_APPLY_HOOKS(image)
+
+# Called as profile_op(op, pc, decoded) when an instruction is decoded and
+# returns the handler to cache instead of op, so profiling costs nothing while
+# it is off.
+def SET_PROFILE_OP(image, MINIRV32_PROFILE_OP_):
+    image.profile_op = MINIRV32_PROFILE_OP_
+    MINIRV32_FLUSH_DECODE_CACHE(image)
+
+# Event hooks, for debugging and tracing.  Registered on an image with
+# SET_HOOK(image, event, hook), None removes one:
+#   instruction(pc, ir)             before each instruction
+#   trap(mcause, mepc, mtval)       when a trap or interrupt is taken
+#   mmio(addy, val, is_store)       after each load or store outside RAM
+#   csr(pc, csrno, rval, writeval)  after each CSR instruction
+# Events nobody hooks cost nothing: MiniRV32IMAStep only runs its instrumented
+# loop while there is an instruction hook, the MMIO hook is wrapped around the
+# control hooks and CSR instructions are decoded to a hooked variant only while
+# they are hooked, and the trap hook is looked at when a trap is taken.
+MINIRV32_HOOK_EVENTS = ('instruction', 'trap', 'mmio', 'csr')
+
+def SET_HOOK(image, event, hook):
+    if event not in MINIRV32_HOOK_EVENTS:
+        raise ValueError(f"unknown event {event!r}")
+    if hook is None:
+        image.hooks.pop(event, None)
+    else:
+        image.hooks[event] = hook
+    MINIRV32_APPLY_HOOKS(image)
+    if event == 'csr':
+        MINIRV32_FLUSH_DECODE_CACHE(image)
+
+def MINIRV32_APPLY_HOOKS(image):
+    hooks = image.hooks
+    store, load = image.mem_handlers
+    mmio = hooks.get('mmio')
+    if mmio is not None:
+        platform_store = store
+        platform_load = load
+        def store(addy, val):
+            ret = platform_store(addy, val)
+            mmio(addy, val, True)
+            return ret
+        def load(addy):
+            val = platform_load(addy)
+            mmio(addy, val, False)
+            return val
+    image.mem_store_control = store
+    image.mem_load_control = load
+    image.instruction_hook = hooks.get('instruction')
+    image.trap_hook = hooks.get('trap')
+
+def MINIRV32_NO_MEM_STORE_CONTROL(addy, val):
+    raise MiniRV32IMATrap(7 + 1, addy)
+
+def MINIRV32_NO_MEM_LOAD_CONTROL(addy):
+    raise MiniRV32IMATrap(5 + 1, addy)
+
+# Decoded instruction cache, kept per image.
+# image.decode_cache maps a guest pc to the operands decoded from the word at
+# that pc, image.block_cache maps a guest pc to the translated block starting
+# there (see mini_rv32ima_translator.py).  image.decode_pages maps an image
+# page to the pcs cached from it so that stores into a page holding code drop
+# the stale entries of both caches.
+MINIRV32_DECODE_PAGE_SHIFT = 12
+
+def MINIRV32_FLUSH_DECODE_CACHE(image):
+    image.decode_cache.clear()
+    image.block_cache.clear()
+    image.decode_pages.clear()
+
+def MINIRV32_INVALIDATE_PAGE(image, page):
+    decode_cache = image.decode_cache
+    block_cache = image.block_cache
+    for pc in image.decode_pages.pop(page):
+        decode_cache.pop(pc, None)
+        block_cache.pop(pc, None)
+
+# Guest RAM.
+# An anonymous memory map: allocating it costs nothing, the host commits a page
+# the first time the guest writes it and untouched pages read as zero, so a
+# guest only takes as much resident memory as it uses.  It also carries
+# memoryview casts of itself, so aligned loads and stores index the image
+# directly instead of slicing it.  Unaligned accesses go through the struct
+# unpack_from/pack_into helpers below, neither allocates.
+# Like the C original, the views assume a little endian host.
+# dirty holds one byte per page (same pages as the decode cache), set by the
+# store helpers and cleared by whoever checkpoints the image.
+# The image also holds the decode caches and the platform hooks of its machine.
+class MiniRV32IMARam(mmap.mmap):
+    def __new__(cls, size):
+        return super().__new__(cls, -1, (size + 3) & ~3)
+
+    def __init__(self, size):
+        view = memoryview(self)
+        self.u32 = view.cast('I')
+        self.u16 = view.cast('H')
+        self.s16 = view.cast('h')
+        self.s8 = view.cast('b')
+        self.dirty = bytearray((len(self) + (1 << MINIRV32_DECODE_PAGE_SHIFT) - 1) >> MINIRV32_DECODE_PAGE_SHIFT)
+        self.decode_cache = {}
+        self.block_cache = {}
+        self.decode_pages = {}
+        self.hooks = {}
+        self.translation_cache = None  # See mini_rv32ima_translator.py
+        SET_HANDLERS(self, None, MINIRV32_NO_MEM_STORE_CONTROL, MINIRV32_NO_MEM_LOAD_CONTROL, None, None)
+        self.profile_op = None
+
+    def dirty_runs(self):
+        # Yields (first page, page count) for every run of dirty pages.
+        dirty = self.dirty
+        page = dirty.find(1)
+        while page >= 0:
+            end = dirty.find(0, page)
+            if end < 0:
+                end = len(dirty)
+            yield page, end - page
+            page = dirty.find(1, end)
+
+    def clear_dirty(self):
+        self.dirty[:] = bytes(len(self.dirty))
+
+UNPACK_U32 = struct.Struct('<I').unpack_from
+UNPACK_U16 = struct.Struct('<H').unpack_from
+UNPACK_S16 = struct.Struct('<h').unpack_from
+PACK_U32 = struct.Struct('<I').pack_into
+PACK_U16 = struct.Struct('<H').pack_into
 
 def MINIRV32_STORE4(image, ofs, val):
-    image[ofs:ofs + 4] = val.to_bytes(4, byteorder='little')
+    if ofs & 3:
+        PACK_U32(image, ofs, val)
+        image.dirty[(ofs + 3) >> MINIRV32_DECODE_PAGE_SHIFT] = 1
+    else:
+        image.u32[ofs >> 2] = val
+    image.dirty[ofs >> MINIRV32_DECODE_PAGE_SHIFT] = 1
+    decode_pages = image.decode_pages
+    if decode_pages:
+        page = ofs >> MINIRV32_DECODE_PAGE_SHIFT
+        if page in decode_pages:
+            MINIRV32_INVALIDATE_PAGE(image, page)
+        page = (ofs + 3) >> MINIRV32_DECODE_PAGE_SHIFT
+        if page in decode_pages:
+            MINIRV32_INVALIDATE_PAGE(image, page)
 
 def MINIRV32_STORE2(image, ofs, val):
-    image[ofs:ofs + 2] = (val & 0xFFFF).to_bytes(2, byteorder='little')
+    if ofs & 1:
+        PACK_U16(image, ofs, val & 0xFFFF)
+        image.dirty[(ofs + 1) >> MINIRV32_DECODE_PAGE_SHIFT] = 1
+    else:
+        image.u16[ofs >> 1] = val & 0xFFFF
+    image.dirty[ofs >> MINIRV32_DECODE_PAGE_SHIFT] = 1
+    decode_pages = image.decode_pages
+    if decode_pages:
+        page = ofs >> MINIRV32_DECODE_PAGE_SHIFT
+        if page in decode_pages:
+            MINIRV32_INVALIDATE_PAGE(image, page)
+        page = (ofs + 1) >> MINIRV32_DECODE_PAGE_SHIFT
+        if page in decode_pages:
+            MINIRV32_INVALIDATE_PAGE(image, page)
 
 def MINIRV32_STORE1(image, ofs, val):
     image[ofs] = val & 0xFF
+    image.dirty[ofs >> MINIRV32_DECODE_PAGE_SHIFT] = 1
+    decode_pages = image.decode_pages
+    if decode_pages:
+        page = ofs >> MINIRV32_DECODE_PAGE_SHIFT
+        if page in decode_pages:
+            MINIRV32_INVALIDATE_PAGE(image, page)
+
+def MINIRV32_STORE_RANGE(image, ofs, length):
+    # For writes into the image the store helpers do not see, e.g. a device
+    # copying into guest RAM: marks the pages dirty and drops what was decoded
+    # from them.
+    first = ofs >> MINIRV32_DECODE_PAGE_SHIFT
+    last = (ofs + length - 1) >> MINIRV32_DECODE_PAGE_SHIFT
+    image.dirty[first:last + 1] = b'\1' * (last + 1 - first)
+    decode_pages = image.decode_pages
+    if decode_pages:
+        for page in range(first, last + 1):
+            if page in decode_pages:
+                MINIRV32_INVALIDATE_PAGE(image, page)
 
 def MINIRV32_LOAD4(image, ofs):
-    r =  struct.unpack('<I', image[ofs:ofs+4])[0]
-    return r
+    if ofs & 3:
+        return UNPACK_U32(image, ofs)[0]
+    return image.u32[ofs >> 2]
 
 def MINIRV32_LOAD2(image, ofs):
-    return struct.unpack('<H', image[ofs:ofs+2])[0]
+    if ofs & 1:
+        return UNPACK_U16(image, ofs)[0]
+    return image.u16[ofs >> 1]
 
 def MINIRV32_LOAD1(image, ofs):
-    return struct.unpack('<B', image[ofs:ofs+1])[0]
+    return image[ofs]
 
 def MINIRV32_LOAD2_SIGNED(image, ofs):
-    return struct.unpack('<h', image[ofs:ofs+2])[0]
+    if ofs & 1:
+        return UNPACK_S16(image, ofs)[0]
+    return image.s16[ofs >> 1]
 
 def MINIRV32_LOAD1_SIGNED(image, ofs):
-    return struct.unpack('<b', image[ofs:ofs+1])[0]
+    return image.s8[ofs]
 
 # Struct
+# The fields after regs, in the order of struct MiniRV32IMAState in the C
+# original.  MINIRV32_STATE_LAYOUT is that struct as bytes: 48 little endian
+# uint32_t, 192 bytes.
+MINIRV32_STATE_FIELDS = ('pc', 'mstatus', 'cyclel', 'cycleh', 'timerl', 'timerh', 'timermatchl', 'timermatchh',
+                         'mscratch', 'mtvec', 'mie', 'mip', 'mepc', 'mtval', 'mcause', 'extraflags')
+MINIRV32_STATE_LAYOUT = struct.Struct('<48I')
+MINIRV32_STATE_SIZE = MINIRV32_STATE_LAYOUT.size
+
 class MiniRV32IMAState():
-    regs = [i for i in range(32)]
-    pc = 0
-    mstatus = 0
-    cyclel = 0
-    cycleh = 0
-    timerl = 0
-    timerh = 0
-    timermatchl = 0
-    timermatchh = 0
-    mscratch = 0
-    mtvec = 0
-    mie = 0
-    mip = 0
-    mepc = 0
-    mtval = 0
-    mcause = 0
-    extraflags = 0
-    
+    # Registers are a list rather than an array('I'): every read from an array
+    # boxes a new int, which makes register access slower.
+    __slots__ = ('regs',) + MINIRV32_STATE_FIELDS
+
+    def __init__(self):
+        self.regs = [0] * 32
+        for name in MINIRV32_STATE_FIELDS:
+            setattr(self, name, 0)
+
+    def pack_into(self, buffer, offset=0):
+        # Store the whole state in the C layout.
+        MINIRV32_STATE_LAYOUT.pack_into(buffer, offset, *[v & 0xFFFFFFFF for v in self.regs],
+                                        *[getattr(self, name) & 0xFFFFFFFF for name in MINIRV32_STATE_FIELDS])
+
+    def unpack_from(self, buffer, offset=0):
+        # Load the whole state from the C layout.
+        values = MINIRV32_STATE_LAYOUT.unpack_from(buffer, offset)
+        self.regs[:] = values[:32]
+        for name, value in zip(MINIRV32_STATE_FIELDS, values[32:]):
+            setattr(self, name, value)
+
+    def to_bytes(self):
+        buffer = bytearray(MINIRV32_STATE_SIZE)
+        self.pack_into(buffer)
+        return bytes(buffer)
+
+# Decode
+def MiniRV32IMADecode(ir):
+    # Returns (cmd, rdid, rs1, rs2, funct3, imm, ir) where rs1/rs2 are register
+    # numbers and imm is the sign extended immediate for the instruction format.
+    cmd = ir & 0x7f
+    rdid = (ir >> 7) & 0x1f
+    rs1 = (ir >> 15) & 0x1f
+    rs2 = (ir >> 20) & 0x1f
+    funct3 = (ir >> 12) & 0x7
+    imm = 0
+    if cmd == 0x37 or cmd == 0x17:  # LUI, AUIPC
+        imm = ir & 0xfffff000
+    elif cmd == 0x6F:  # JAL
+        imm = ((ir & 0x80000000) >> 11) | ((ir & 0x7fe00000) >> 20) | ((ir & 0x00100000) >> 9) | ((ir & 0x000ff000))
+        if imm & 0x00100000:
+            imm |= 0xffe00000  # Sign extension.
+    elif cmd == 0x63:  # Branch
+        imm = ((ir & 0xf00) >> 7) | ((ir & 0x7e000000) >> 20) | ((ir & 0x80) << 4) | ((ir >> 31) << 12)
+        if imm & 0x1000:
+            imm |= 0xffffe000
+        rdid = 0
+    elif cmd == 0x23:  # Store
+        imm = ((ir >> 7) & 0x1f) | ((ir & 0xfe000000) >> 20)
+        if imm & 0x800:
+            imm |= 0xfffff000
+        rdid = 0
+    elif cmd == 0x73:  # Zifencei+Zicsr, imm is the csr number
+        imm = ir >> 20
+    elif cmd == 0x2f:  # RV32A, imm is irmid
+        imm = (ir >> 27) & 0x1f
+    else:  # JALR, Load, Op-immediate
+        imm = ir >> 20
+        imm = imm | (0xfffff000 if (imm & 0x800) else 0)
+    return (cmd, rdid, rs1, rs2, funct3, imm, ir)
+
+# Instruction handlers.
+# Decoding binds the operands of an instruction into a handler, picked through
+# MINIRV32_OPCODES (indexed by opcode) and the funct3/funct7/irmid tables
+# below, and the decode cache keeps that handler.  The opcode constructors are
+# also given the size of the image, which bounds loads, stores and AMOs.  A handler is called as
+# op(state, regs, image, pc, cycle), executes the instruction and returns the
+# next pc.  Traps are raised as MiniRV32IMATrap and a non-zero return value of
+# MiniRV32IMAStep (WFI, syscon) as MiniRV32IMAExit.
+class MiniRV32IMATrap(Exception):
+    def __init__(self, trap, rval=0):
+        self.trap = trap  # mcause + 1
+        self.rval = rval  # mtval of access faults
+
+class MiniRV32IMAExit(Exception):
+    def __init__(self, ret):
+        self.ret = ret
+
+def NOP(state, regs, image, pc, cycle):
+    return pc + 4
+
+def ILLEGAL(state, regs, image, pc, cycle):
+    raise MiniRV32IMATrap(2 + 1)
+
+def OP_ILLEGAL(rdid, rs1, rs2, funct3, imm, ir, ram_size=0):
+    return ILLEGAL
+
+def OP_LUI(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        return NOP
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = imm
+        return pc + 4
+    return op
+
+def OP_AUIPC(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        return NOP
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_JAL(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        def op(state, regs, image, pc, cycle):
+            return (pc + imm) & 0xFFFFFFFF
+        return op
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (pc + 4) & 0xFFFFFFFF
+        return (pc + imm) & 0xFFFFFFFF
+    return op
+
+def OP_JALR(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        def op(state, regs, image, pc, cycle):
+            return (regs[rs1] + imm) & 0xFFFFFFFE
+        return op
+    def op(state, regs, image, pc, cycle):
+        target = (regs[rs1] + imm) & 0xFFFFFFFE
+        regs[rdid] = (pc + 4) & 0xFFFFFFFF
+        return target
+    return op
+
+# Branch (0b1100011), indexed by funct3.
+def OP_BEQ(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if regs[rs1] == regs[rs2]:
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_BNE(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if regs[rs1] != regs[rs2]:
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_BLT(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if (regs[rs1] ^ 0x80000000) < (regs[rs2] ^ 0x80000000):
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_BGE(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if (regs[rs1] ^ 0x80000000) >= (regs[rs2] ^ 0x80000000):
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_BLTU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if regs[rs1] < regs[rs2]:
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_BGEU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        if regs[rs1] >= regs[rs2]:
+            return (pc + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+MINIRV32_BRANCH = [OP_BEQ, OP_BNE, OP_ILLEGAL, OP_ILLEGAL, OP_BLT, OP_BGE, OP_BLTU, OP_BGEU]
+
+def OP_BRANCH(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    return MINIRV32_BRANCH[funct3](rdid, rs1, rs2, funct3, imm, ir)
+
+# Load (0b0000011), the loaders are indexed by funct3.
+MINIRV32_LOAD = [MINIRV32_LOAD1_SIGNED, MINIRV32_LOAD2_SIGNED, MINIRV32_LOAD4, None, MINIRV32_LOAD1, MINIRV32_LOAD2, None, None]
+
+def OP_LOAD(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    load = MINIRV32_LOAD[funct3]
+    if load is None:
+        return ILLEGAL
+    ofs = (imm - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+    limit = ram_size - 3
+    def op(state, regs, image, pc, cycle):
+        rsval = (regs[rs1] + ofs) & 0xFFFFFFFF
+        if rsval >= limit:
+            rval = image.mem_load_control((rsval + MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF)
+        else:
+            rval = load(image, rsval)
+        if rdid:
+            regs[rdid] = rval & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+# Store (0b0100011), the storers are indexed by funct3.
+MINIRV32_STORE = [MINIRV32_STORE1, MINIRV32_STORE2, MINIRV32_STORE4, None, None, None, None, None]
+
+def OP_STORE(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    store = MINIRV32_STORE[funct3]
+    if store is None:
+        return ILLEGAL
+    ofs = (imm - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+    limit = ram_size - 3
+    def op(state, regs, image, pc, cycle):
+        addy = (regs[rs1] + ofs) & 0xFFFFFFFF
+        if addy >= limit:
+            ret = image.mem_store_control((addy + MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF, regs[rs2])
+            if ret:
+                raise MiniRV32IMAExit(ret)
+        else:
+            store(image, addy, regs[rs2])
+        return pc + 4
+    return op
+
+# Op-immediate (0b0010011), indexed by funct3.
+def OP_ADDI(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] + imm) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_SLLI(rdid, rs1, rs2, funct3, imm, ir):
+    shift = imm & 0x1F
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] << shift) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_SLTI(rdid, rs1, rs2, funct3, imm, ir):
+    flipped = imm ^ 0x80000000
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = int((regs[rs1] ^ 0x80000000) < flipped)
+        return pc + 4
+    return op
+
+def OP_SLTIU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = int(regs[rs1] < imm)
+        return pc + 4
+    return op
+
+def OP_XORI(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] ^ imm
+        return pc + 4
+    return op
+
+def OP_SRLI(rdid, rs1, rs2, funct3, imm, ir):
+    shift = imm & 0x1F
+    if ir & 0x40000000:
+        def op(state, regs, image, pc, cycle):
+            regs[rdid] = (((regs[rs1] ^ 0x80000000) - 0x80000000) >> shift) & 0xFFFFFFFF
+            return pc + 4
+        return op
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] >> shift
+        return pc + 4
+    return op
+
+def OP_ORI(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] | imm
+        return pc + 4
+    return op
+
+def OP_ANDI(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] & imm
+        return pc + 4
+    return op
+
+MINIRV32_OP_IMM = [OP_ADDI, OP_SLLI, OP_SLTI, OP_SLTIU, OP_XORI, OP_SRLI, OP_ORI, OP_ANDI]
+
+# Op (0b0110011), indexed by funct3.  MINIRV32_OP_ALT holds the operations
+# with bit 30 of funct7 set and MINIRV32_OP_M the RV32M ones (bit 25 set).
+def OP_ADD(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] + regs[rs2]) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_SUB(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] - regs[rs2]) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_SLL(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] << (regs[rs2] & 0x1F)) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_SLT(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = int((regs[rs1] ^ 0x80000000) < (regs[rs2] ^ 0x80000000))
+        return pc + 4
+    return op
+
+def OP_SLTU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = int(regs[rs1] < regs[rs2])
+        return pc + 4
+    return op
+
+def OP_XOR(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] ^ regs[rs2]
+        return pc + 4
+    return op
+
+def OP_SRL(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] >> (regs[rs2] & 0x1F)
+        return pc + 4
+    return op
+
+def OP_SRA(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (((regs[rs1] ^ 0x80000000) - 0x80000000) >> (regs[rs2] & 0x1F)) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_OR(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] | regs[rs2]
+        return pc + 4
+    return op
+
+def OP_AND(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = regs[rs1] & regs[rs2]
+        return pc + 4
+    return op
+
+def OP_MUL(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] * regs[rs2]) & 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_MULH(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = MINIRV32_MULH(regs[rs1], regs[rs2])
+        return pc + 4
+    return op
+
+def OP_MULHSU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = MINIRV32_MULHSU(regs[rs1], regs[rs2])
+        return pc + 4
+    return op
+
+def OP_MULHU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = (regs[rs1] * regs[rs2]) >> 32
+        return pc + 4
+    return op
+
+def OP_DIV(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = MINIRV32_DIV(regs[rs1], regs[rs2])
+        return pc + 4
+    return op
+
+def OP_DIVU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        b = regs[rs2]
+        regs[rdid] = (regs[rs1] // b) if b else 0xFFFFFFFF
+        return pc + 4
+    return op
+
+def OP_REM(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        regs[rdid] = MINIRV32_REM(regs[rs1], regs[rs2])
+        return pc + 4
+    return op
+
+def OP_REMU(rdid, rs1, rs2, funct3, imm, ir):
+    def op(state, regs, image, pc, cycle):
+        b = regs[rs2]
+        regs[rdid] = (regs[rs1] % b) if b else regs[rs1]
+        return pc + 4
+    return op
+
+MINIRV32_OP = [OP_ADD, OP_SLL, OP_SLT, OP_SLTU, OP_XOR, OP_SRL, OP_OR, OP_AND]
+MINIRV32_OP_ALT = [OP_SUB, OP_SLL, OP_SLT, OP_SLTU, OP_XOR, OP_SRA, OP_OR, OP_AND]
+MINIRV32_OP_M = [OP_MUL, OP_MULH, OP_MULHSU, OP_MULHU, OP_DIV, OP_DIVU, OP_REM, OP_REMU]
+
+def OP_OP_IMM(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        return NOP
+    return MINIRV32_OP_IMM[funct3](rdid, rs1, rs2, funct3, imm, ir)
+
+def OP_OP(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    if not rdid:
+        return NOP
+    if ir & 0x02000000:
+        table = MINIRV32_OP_M
+    elif ir & 0x40000000:
+        table = MINIRV32_OP_ALT
+    else:
+        table = MINIRV32_OP
+    return table[funct3](rdid, rs1, rs2, funct3, imm, ir)
+
+def OP_FENCE(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    #fencetype = (ir >> 12) & 0b111; We ignore fences in this impl
+    return NOP
+
+# Zicsr, the CSRs kept in the state are indexed by csr number.  Other CSRs go
+# to the othercsr_read/write hooks of the image.
+MINIRV32_CSR_READ = {
+    0x340: lambda state, cycle: state.mscratch,
+    0x305: lambda state, cycle: state.mtvec,
+    0x304: lambda state, cycle: state.mie,
+    0xC00: lambda state, cycle: cycle,
+    0x344: lambda state, cycle: state.mip,
+    0x341: lambda state, cycle: state.mepc,
+    0x300: lambda state, cycle: state.mstatus,
+    0x342: lambda state, cycle: state.mcause,
+    0x343: lambda state, cycle: state.mtval,
+    0xf11: lambda state, cycle: 0xff0ff0ff,  # mvendorid
+    0x301: lambda state, cycle: 0x40401101,  # misa (XLEN=32, IMA+X)
+}
+
+MINIRV32_CSR_WRITE = {
+    0x340: lambda state, value: setattr(state, 'mscratch', value),
+    0x305: lambda state, value: setattr(state, 'mtvec', value),
+    0x304: lambda state, value: setattr(state, 'mie', value),
+    0x344: lambda state, value: setattr(state, 'mip', value),
+    0x341: lambda state, value: setattr(state, 'mepc', value),
+    0x300: lambda state, value: setattr(state, 'mstatus', value),
+    0x342: lambda state, value: setattr(state, 'mcause', value),
+    0x343: lambda state, value: setattr(state, 'mtval', value),
+}
+
+# New csr value from the read value and the source operand, indexed by funct3.
+MINIRV32_CSR_OPS = [
+    None,
+    lambda rval, src: src,  # CSRRW
+    lambda rval, src: rval | src,  # CSRRS
+    lambda rval, src: rval & ~src,  # CSRRC
+    None,
+    lambda rval, src: src,  # CSRRWI
+    lambda rval, src: rval | src,  # CSRRSI
+    lambda rval, src: rval & ~src,  # CSRRCI
+]
+
+def OP_CSR(rdid, rs1, rs2, funct3, imm, ir, hook=None):
+    csrno = imm
+    read = MINIRV32_CSR_READ.get(csrno)
+    write = MINIRV32_CSR_WRITE.get(csrno)
+    csrop = MINIRV32_CSR_OPS[funct3]
+    from_reg = not (funct3 & 4)
+    def op(state, regs, image, pc, cycle):
+        rval = read(state, cycle) if read else image.othercsr_read(image, csrno)
+        writeval = csrop(rval, regs[rs1] if from_reg else rs1)
+        if write:
+            write(state, writeval)
+        else:
+            image.othercsr_write(image, csrno, writeval)
+        if rdid:
+            regs[rdid] = rval & 0xFFFFFFFF
+        return pc + 4
+    if hook is None:
+        return op
+    def hooked(state, regs, image, pc, cycle):
+        rval = read(state, cycle) if read else image.othercsr_read(image, csrno)
+        writeval = csrop(rval, regs[rs1] if from_reg else rs1)
+        if write:
+            write(state, writeval)
+        else:
+            image.othercsr_write(image, csrno, writeval)
+        if rdid:
+            regs[rdid] = rval & 0xFFFFFFFF
+        hook(pc, csrno, rval & 0xFFFFFFFF, writeval & 0xFFFFFFFF)
+        return pc + 4
+    return hooked
+
+def WFI(state, regs, image, pc, cycle):
+    state.mstatus |= 8
+    state.extraflags |= 4
+    raise MiniRV32IMAExit(1)
+
+def MRET(state, regs, image, pc, cycle):
+    startmstatus = state.mstatus
+    startextraflags = state.extraflags
+    state.mstatus = ((startmstatus & 0x80) >> 4) | ((startextraflags & 3) << 11) | 0x80
+    state.extraflags = (startextraflags & ~3) | ((startmstatus >> 11) & 3)
+    return state.mepc
+
+def ECALL(state, regs, image, pc, cycle):
+    raise MiniRV32IMATrap((11 + 1) if (state.extraflags & 3) else (8 + 1))
+
+def EBREAK(state, regs, image, pc, cycle):
+    raise MiniRV32IMATrap(3 + 1)
+
+def OP_SYSTEM(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    csrno = imm
+    if funct3 & 3:
+        return OP_CSR(rdid, rs1, rs2, funct3, imm, ir)
+    elif funct3 == 0:
+        if csrno == 0x105:
+            return WFI
+        elif (csrno & 0xff) == 0x02:
+            return MRET
+        elif csrno == 0:
+            return ECALL
+        elif csrno == 1:
+            return EBREAK
+    return ILLEGAL
+
+# RV32A (0b00101111), the read-modify-write operations are indexed by irmid.
+MINIRV32_AMO = [None] * 32
+MINIRV32_AMO[1] = lambda rs2, rval: rs2  # AMOSWAP
+MINIRV32_AMO[0] = lambda rs2, rval: (rs2 + rval) & 0xFFFFFFFF  # AMOADD
+MINIRV32_AMO[4] = lambda rs2, rval: rs2 ^ rval  # AMOXOR
+MINIRV32_AMO[12] = lambda rs2, rval: rs2 & rval  # AMOAND
+MINIRV32_AMO[8] = lambda rs2, rval: rs2 | rval  # AMOOR
+MINIRV32_AMO[16] = lambda rs2, rval: rs2 if ((rs2 ^ 0x80000000) < (rval ^ 0x80000000)) else rval  # AMOMIN
+MINIRV32_AMO[20] = lambda rs2, rval: rs2 if ((rs2 ^ 0x80000000) > (rval ^ 0x80000000)) else rval  # AMOMAX
+MINIRV32_AMO[24] = lambda rs2, rval: rs2 if (rs2 < rval) else rval  # AMOMINU
+MINIRV32_AMO[28] = lambda rs2, rval: rs2 if (rs2 > rval) else rval  # AMOMAXU
+
+def OP_AMO(rdid, rs1, rs2, funct3, imm, ir, ram_size):
+    irmid = imm
+    amo = MINIRV32_AMO[irmid]
+    limit = ram_size - 3
+    def op(state, regs, image, pc, cycle):
+        addy = (regs[rs1] - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+        if addy >= limit:
+            raise MiniRV32IMATrap(7 + 1, (addy + MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF)
+        rval = MINIRV32_LOAD4(image, addy)
+        if irmid == 2:  # LR.W
+            state.extraflags = ((state.extraflags & 0x07) | (addy << 3)) & 0xFFFFFFFF
+        elif irmid == 3:  # SC.W
+            rval = int(state.extraflags >> 3 != (addy & 0x1fffffff))
+            if not rval:
+                MINIRV32_STORE4(image, addy, regs[rs2])
+        elif amo:
+            MINIRV32_STORE4(image, addy, amo(regs[rs2], rval))
+        else:
+            raise MiniRV32IMATrap(2 + 1)
+        if rdid:
+            regs[rdid] = rval
+        return pc + 4
+    return op
+
+MINIRV32_OPCODES = [OP_ILLEGAL] * 128
+MINIRV32_OPCODES[0x37] = OP_LUI
+MINIRV32_OPCODES[0x17] = OP_AUIPC
+MINIRV32_OPCODES[0x6F] = OP_JAL
+MINIRV32_OPCODES[0x67] = OP_JALR
+MINIRV32_OPCODES[0x63] = OP_BRANCH
+MINIRV32_OPCODES[0x03] = OP_LOAD
+MINIRV32_OPCODES[0x23] = OP_STORE
+MINIRV32_OPCODES[0x13] = OP_OP_IMM
+MINIRV32_OPCODES[0x33] = OP_OP
+MINIRV32_OPCODES[0x0f] = OP_FENCE
+MINIRV32_OPCODES[0x73] = OP_SYSTEM
+MINIRV32_OPCODES[0x2f] = OP_AMO
+
+def MiniRV32IMAFetch(image, pc):
+    # Decodes the instruction at pc into its handler and caches (handler, ir).
+    ram_size = len(image)
+    ofs_pc = (pc - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+    if ofs_pc >= ram_size:
+        raise MiniRV32IMATrap(1 + 1)
+    elif ofs_pc & 3:
+        raise MiniRV32IMATrap(1 + 0)
+    decoded = MiniRV32IMADecode(MINIRV32_LOAD4(image, ofs_pc))
+    cmd, rdid, rs1, rs2, funct3, imm, ir = decoded
+    op = MINIRV32_OPCODES[cmd](rdid, rs1, rs2, funct3, imm, ir, ram_size)
+    if cmd == 0x73 and funct3 & 3 and 'csr' in image.hooks:
+        op = OP_CSR(rdid, rs1, rs2, funct3, imm, ir, image.hooks['csr'])
+    if image.profile_op:
+        op = image.profile_op(op, pc, decoded)
+    entry = (op, ir)
+    image.decode_cache[pc] = entry
+    decode_pages = image.decode_pages
+    page = ofs_pc >> MINIRV32_DECODE_PAGE_SHIFT
+    if page in decode_pages:
+        decode_pages[page].append(pc)
+    else:
+        decode_pages[page] = [pc]
+    return entry
+
 # Function
 def MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, count):
     new_timer = state.timerl + elapsedUs
-    if new_timer < state.timerl:
-        state.timerh += 1
+    if new_timer > 0xFFFFFFFF:
+        state.timerh = (state.timerh + (new_timer >> 32)) & 0xFFFFFFFF
+        new_timer &= 0xFFFFFFFF
     state.timerl = new_timer
 
     if (state.timerh > state.timermatchh or (state.timerh == state.timermatchh and state.timerl > state.timermatchl)) and (state.timermatchh or state.timermatchl):
@@ -87,6 +870,10 @@ def MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, count):
     else:
         state.mip &= ~(1 << 7)
 
+    # MEIP of MIP is driven by the platform's interrupt controller.
+    if state.mip & (1 << 11):
+        state.extraflags &= ~4  # Clear WFI
+
     if state.extraflags & 4:
         return 1
 
@@ -95,362 +882,43 @@ def MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, count):
     pc = state.pc
     cycle = state.cyclel
 
-    if (state.mip & (1 << 7)) and (state.mie & (1 << 7)) and (state.mstatus & 0x8):
-        trap = 0x80000007
+    pending = state.mip & state.mie
+    if (pending & ((1 << 11) | (1 << 7))) and (state.mstatus & 0x8):
+        trap = 0x8000000B if pending & (1 << 11) else 0x80000007
         pc -= 4
     else:
-        for icount in range(count):
-            ir = 0
-            rval = 0
-            cycle += 1
-            ofs_pc = pc - MINIRV32_RAM_IMAGE_OFFSET
-
-            if ofs_pc >= MINI_RV32_RAM_SIZE:
-                trap = 1 + 1
-                break
-            elif ofs_pc & 3:
-                trap = 1 + 0
-                break
+        decode_cache = image.decode_cache
+        regs = state.regs
+        instruction_hook = image.instruction_hook
+        try:
+            if instruction_hook is None:
+                for icount in range(count):
+                    cycle += 1
+                    entry = decode_cache.get(pc)
+                    if entry is None:
+                        entry = MiniRV32IMAFetch(image, pc)
+                    pc = entry[0](state, regs, image, pc, cycle)
             else:
-                ir = MINIRV32_LOAD4(image, ofs_pc)
-                rdid = (ir >> 7) & 0x1f
-
-                cmd = ir & 0x7f
-                if cmd == 0x37:  # LUI (0b0110111)
-                    LOG("LUI")
-                    rval = (ir & 0xfffff000)
-                elif cmd == 0x17:  # AUIPC (0b0010111)
-                    LOG("AUIPC")
-                    rval = pc + (ir & 0xfffff000)
-                elif cmd == 0x6F:  # JAL (0b1101111)
-                    LOG("JAL")
-                    reladdy = ((ir & 0x80000000) >> 11) | ((ir & 0x7fe00000) >> 20) | ((ir & 0x00100000) >> 9) | ((ir & 0x000ff000))
-                    if reladdy & 0x00100000:
-                        reladdy |= 0xffe00000  # Sign extension.
-                    rval = pc + 4
-                    pc = (pc + reladdy - 4) & 0xFFFFFFFF
-                elif cmd == 0x67:  # JALR (0b1100111)
-                    LOG("JALR")
-                    imm = ir >> 20
-                    
-                    imm_se = imm | (0xfffff000 if (imm & 0x800) else 0)
-                    rval = pc + 4
-                    rs1 = state.regs[(ir >> 15) & 0x1f]
-                    pc = (((rs1 + imm_se) & ~1) - 4) & 0xFFFFFFFF
-                elif cmd == 0x63:  # Branch (0b1100011)
-                    LOG("Branch")
-                    immm4 = ((ir & 0xf00) >> 7) | ((ir & 0x7e000000) >> 20) | ((ir & 0x80) << 4) | ((ir >> 31) << 12)
-                    if immm4 & 0x1000:
-                        immm4 |= 0xffffe000
-                    rs1 = ctypes.c_int32( state.regs[(ir >> 15) & 0x1f]).value
-                    rs2 = ctypes.c_int32(state.regs[(ir >> 20) & 0x1f]).value
-                    immm4 = (pc + immm4 - 4) & 0xFFFFFFFF
-                    rdid = 0
-                    #BEQ, BNE, BLT, BGE, BLTU, BGEU
-                    irs12 = (ir >> 12) & 0x7
-                    if irs12 == 0:
-                        if rs1 == rs2:
-                            pc = immm4
-                    elif irs12 == 1:
-                        if rs1 != rs2:
-                            pc = immm4
-                    elif irs12== 4:
-                        if rs1 < rs2:
-                            pc = immm4
-                    elif irs12 == 5:
-                        if rs1 >= rs2:
-                            pc = immm4
-                    elif irs12 == 6:
-                        if (ctypes.c_uint32(rs1).value < ctypes.c_uint32(rs2).value):
-                            pc = immm4
-                    elif irs12 == 7:
-                        if (ctypes.c_uint32(rs1).value >= ctypes.c_uint32(rs2).value):
-                            pc = immm4
-                    else:
-                        trap = (2 + 1)
-                elif cmd == 0x03:  # Load (0b0000011)
-                    LOG("Load")
-                    rs1 = state.regs[(ir >> 15) & 0x1f]
-                    imm = ir >> 20
-                    imm_se = imm | (0xfffff000 if (imm & 0x800) else 0)
-                    rsval = (rs1 + imm_se) & 0xFFFFFFFF
-
-                    rsval -= MINIRV32_RAM_IMAGE_OFFSET
-                    rsval &= 0xFFFFFFFF
-                    if rsval >= MINI_RV32_RAM_SIZE - 3:
-                        rsval += MINIRV32_RAM_IMAGE_OFFSET
-                        rsval &= 0xFFFFFFFF
-                        if MINIRV32_MMIO_RANGE(rsval):
-                            rval = MINIRV32_HANDLE_MEM_LOAD_CONTROL(rsval)
-                        else:
-                            trap = (5 + 1)
-                            rval = rsval
-                    else:
-                        #LB, LH, LW, LBU, LHU
-                        irs12 = (ir >> 12) & 0x7
-                        if irs12 == 0:
-                            rval = MINIRV32_LOAD1_SIGNED(image, rsval)
-                        elif irs12 == 1:
-                            rval = MINIRV32_LOAD2_SIGNED(image, rsval)
-                        elif irs12 == 2:
-                            rval = MINIRV32_LOAD4(image, rsval)
-                        elif irs12 == 4:
-                            rval = MINIRV32_LOAD1(image, rsval)
-                        elif irs12 == 5:
-                            rval = MINIRV32_LOAD2(image, rsval)
-                        else:
-                            trap = (2 + 1)
-                elif cmd == 0x23:  # Store 0b0100011
-                    LOG("Store")
-                    rs1 = state.regs[(ir >> 15) & 0x1f]
-                    rs2 = state.regs[(ir >> 20) & 0x1f]
-                    addy = ((ir >> 7) & 0x1f) | ((ir & 0xfe000000) >> 20)
-                    if addy & 0x800:
-                        addy |= 0xfffff000
-                    addy += rs1 - MINIRV32_RAM_IMAGE_OFFSET
-                    addy &= 0xFFFFFFFF
-                    rdid = 0
-
-                    if addy >= MINI_RV32_RAM_SIZE - 3:
-                        addy += MINIRV32_RAM_IMAGE_OFFSET
-                        addy &= 0xFFFFFFFF
-                        if MINIRV32_MMIO_RANGE(addy):
-                            MINIRV32_HANDLE_MEM_STORE_CONTROL(addy, rs2)
-                        else:
-                            trap = (7 + 1)
-                            rval = addy
-                    else:
-                        irs12 = (ir >> 12) & 0x7
-                        if irs12 == 0:
-                            MINIRV32_STORE1(image, addy, rs2)
-                        elif irs12 == 1:
-                            MINIRV32_STORE2(image, addy, rs2)
-                        elif irs12 == 2:
-                            MINIRV32_STORE4(image, addy, rs2)
-                        else:
-                            trap = (2 + 1)
-                elif cmd == 0x13 or cmd == 0x33:  # Op-immediate 0b0010011 or Op 0b0110011
-                    LOG("Op-immediate")
-                    imm = ir >> 20
-                    imm = imm | (0xfffff000 if (imm & 0x800) else 0)
-                    reg = (ir >> 15) & 0x1f
-                    rs1 = state.regs[reg]
-                    is_reg = (ir & 0x20) #check !!
-                    rs2 = state.regs[imm & 0x1f] if is_reg else imm
-
-                    cmd_ = (ir >> 12) & 7
-                    if is_reg and (ir & 0x02000000):
-                        #0x02000000 = RV32M
-                        if cmd_ == 0:
-                            #MUL
-                            rval = rs1 * rs2
-                        elif cmd_ == 1:
-                            #MULH
-                            rval = ((ctypes.c_int64(rs1).value * ctypes.c_int64(rs2).value) >> 32)
-                        elif cmd_ == 2:
-                            #MULHSU
-                            rval = ((ctypes.c_int64(rs1).value * ctypes.c_uint64(rs2).value) >> 32)
-                        elif cmd_ == 3:
-                            #MULHU
-                            rval = ((ctypes.c_uint64(rs1).value * ctypes.c_uint64(rs2).value) >> 32) 
-                        elif cmd_ == 4:
-                            #DIV
-                            if rs2 == 0:
-                                rval = 0xFFFFFFFF #-1
-                            else:
-                                if (rs1 == INT32_MIN and ctypes.c_int32(rs2).value == -1): 
-                                    rval = rs1
-                                else:
-                                    rval = (ctypes.c_int32(rs1).value // ctypes.c_int32(rs2).value)
-                        elif cmd_ == 5:
-                            #DIVU
-                            if rs2 == 0:
-                                rval = 0xffffffff
-                            else:
-                                rval = rs1 // rs2
-                        elif cmd_ == 6:
-                            #REM
-                            if rs2 == 0:
-                                rval = rs1
-                            else:
-                                if (rs1 == INT32_MIN and ctypes.c_int32(rs2).value == INT32_MIN):
-                                    rval = 0 
-                                else:
-                                    rval = (ctypes.c_uint32(rs1).value % ctypes.c_uint32(rs2).value)
-                        elif cmd_ == 7:
-                            #REMU
-                            if rs2 == 0:
-                                rval = rs1
-                            else:
-                                rval = rs1 % rs2
-                    else:
-                        #// These could be either op-immediate or op commands.  Be careful
-                        if cmd_ == 0:
-                            rval = (rs1 - rs2) if is_reg and (ir & 0x40000000) else (rs1 + rs2)
-                        elif cmd_ == 1:
-                            rval = rs1 << (rs2 & 0x1F)
-                        elif cmd_ == 2:
-                            rval = (ctypes.c_int32(rs1).value < ctypes.c_int32(rs2).value)
-                        elif cmd_ == 3:
-                            rval = rs1 < rs2
-                        elif cmd_ == 4:
-                            rval = rs1 ^ rs2
-                        elif cmd_ == 5:
-                            shift_len = rs2 & 0x1F
-                            rval = ((ctypes.c_int32(rs1).value >> (shift_len)) if (ir & 0x40000000) else (rs1 >> (shift_len)))
-                        elif cmd_ == 6:
-                            rval = rs1 | rs2
-                        elif cmd_ == 7:
-                            rval = rs1 & rs2
-                elif cmd == 0x0f:  # 0b0001111
-                    LOG("0b0001111")
-                    #fencetype = (ir >> 12) & 0b111; We ignore fences in this impl
-                    rdid = 0
-                elif cmd == 0x73:  # Zifencei+Zicsr  (0b1110011)
-                    LOG("Zifencei+Zicsr")
-                    csrno = ir >> 20
-                    microop = (ir >> 12) & 0x7
-                    if (microop & 3):
-                        rs1imm = (ir >> 15) & 0x1f
-                        rs1 = state.regs[rs1imm]
-                        writeval = rs1
-
-                        if csrno == 0x340:
-                            rval = state.mscratch
-                        elif csrno == 0x305:
-                            rval = state.mtvec
-                        elif csrno == 0x304:
-                            rval = state.mie
-                        elif csrno == 0xC00:
-                            rval = cycle
-                        elif csrno == 0x344:
-                            rval = state.mip
-                        elif csrno == 0x341:
-                            rval = state.mepc
-                        elif csrno == 0x300:
-                            rval = state.mstatus
-                        elif csrno == 0x342:
-                            rval = state.mcause
-                        elif csrno == 0x343:
-                            rval = state.mtval
-                        elif csrno == 0xf11:
-                            rval = 0xff0ff0ff
-                        elif csrno == 0x301:
-                            rval = 0x40401101
-                        else:
-                            rval = MINIRV32_OTHERCSR_READ(image, csrno)
-
-                        if microop == 1:
-                            writeval = rs1
-                        elif microop == 2:
-                            writeval = rval | rs1
-                        elif microop == 3:
-                            writeval = rval & ~rs1
-                        elif microop == 5:
-                            writeval = rs1imm
-                        elif microop == 6:
-                            writeval = rval | rs1imm
-                        elif microop == 7:
-                            writeval = rval & ~rs1imm
-
-                        if csrno == 0x340:
-                            state.mscratch = writeval
-                        elif csrno == 0x305:
-                            state.mtvec = writeval
-                        elif csrno == 0x304:
-                            state.mie = writeval
-                        elif csrno == 0x344:
-                            state.mip = writeval
-                        elif csrno == 0x341:
-                            state.mepc = writeval
-                        elif csrno == 0x300:
-                            state.mstatus = writeval
-                        elif csrno == 0x342:
-                            state.mcause = writeval
-                        elif csrno == 0x343:
-                            state.mtval = writeval
-                        else:
-                            MINIRV32_OTHERCSR_WRITE(image, csrno, writeval)
-                    elif microop == 0x0:
-                        rdid = 0
-                        if csrno == 0x105:
-                            state.mstatus |= 8
-                            state.extraflags |= 4
-                            state.pc = pc + 4
-                            return 1
-                        elif (csrno & 0xff) == 0x02:
-                            startmstatus = state.mstatus
-                            startextraflags = state.extraflags
-                            state.mstatus = ((startmstatus & 0x80) >> 4) | ((startextraflags & 3) << 11) | 0x80
-                            state.extraflags = (startextraflags & ~3) | ((startmstatus >> 11) & 3)
-                            pc = state.mepc - 4
-                        else:
-                            if csrno == 0:
-                                trap = (11 + 1) if (state.extraflags & 3) else (8 + 1)
-                            elif csrno == 1:
-                                trap = (3 + 1)
-                            else:
-                                trap = (2 + 1)
-                    else:
-                        trap = (2 + 1)
-                elif cmd == 0x2f:  # RV32A (0b00101111)
-                    LOG("RV32A")
-                    rs1 = state.regs[(ir >> 15) & 0x1f]
-                    rs2 = state.regs[(ir >> 20) & 0x1f]
-                    irmid = (ir >> 27) & 0x1f
-
-                    rs1 -= MINIRV32_RAM_IMAGE_OFFSET
-
-                    if rs1 >= MINI_RV32_RAM_SIZE - 3:
-                        trap = (7 + 1)
-                        rval = rs1 + MINIRV32_RAM_IMAGE_OFFSET
-                    else:
-                        rval = MINIRV32_LOAD4(image, rs1)
-
-                        dowrite = 1
-                        if irmid == 2:
-                            dowrite = 0
-                            state.extraflags = (state.extraflags & 0x07) | (rs1 << 3)
-                        elif irmid == 3:
-                            rval = (state.extraflags >> 3 != (rs1 & 0x1fffffff))
-                            dowrite = not rval
-                        elif irmid == 1:
-                            pass
-                        elif irmid == 0:
-                            rs2 += rval
-                            rs2 &= 0xFFFFFFFF
-                        elif irmid == 4:
-                            rs2 ^= rval
-                        elif irmid == 12:
-                            rs2 &= rval
-                        elif irmid == 8:
-                            rs2 |= rval
-                        elif irmid == 16:
-                            rs2 = (rs2 if (ctypes.c_int32(rs2).value < ctypes.c_int32(rval).value) else rval)
-                        elif irmid == 20:
-                            rs2 = (rs2 if (ctypes.c_int32(rs2).value > ctypes.c_int32(rval).value) else rval)
-                        elif irmid == 24:
-                            rs2 = rs2 if (rs2 < rval) else rval
-                        elif irmid == 28:
-                            rs2 = rs2 if (rs2 > rval) else rval
-                        else:
-                            trap = (2 + 1)
-                            dowrite = 0
-                        if dowrite:
-                            MINIRV32_STORE4(image, rs1, rs2)
-                else:
-                    trap = (2 + 1)
-
-                if trap:
-                    break
-
-                if rdid:
-                    state.regs[rdid] = rval & 0xFFFFFFFF
-
-
-            MINIRV32_POSTEXEC(pc, ir, trap)
-
-            pc += 4
+                for icount in range(count):
+                    cycle += 1
+                    entry = decode_cache.get(pc)
+                    if entry is None:
+                        entry = MiniRV32IMAFetch(image, pc)
+                    instruction_hook(pc, entry[1])
+                    pc = entry[0](state, regs, image, pc, cycle)
+        except MiniRV32IMATrap as t:
+            trap = t.trap
+            rval = t.rval
+            if image.postexec is not None:
+                entry = decode_cache.get(pc)
+                trap = image.postexec(pc, entry[1] if entry else 0, trap)
+        except MiniRV32IMAExit as e:
+            if cycle > 0xFFFFFFFF:
+                state.cycleh = (state.cycleh + 1) & 0xFFFFFFFF
+                cycle &= 0xFFFFFFFF
+            state.pc = pc + 4
+            state.cyclel = cycle
+            return e.ret
 
     if trap:
         if trap & 0x80000000:
@@ -462,15 +930,26 @@ def MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, count):
             state.mtval = rval if (trap > 5 and trap <= 8) else pc
         state.mepc = pc
         state.mstatus = ((state.mstatus & 0x08) << 4) | ((state.extraflags & 3) << 11)
-        pc = (state.mtvec - 4)
+        pc = state.mtvec
+        if image.trap_hook is not None:
+            image.trap_hook(state.mcause, state.mepc, state.mtval)
 
         state.extraflags |= 3
 
         trap = 0
-        pc += 4
 
-    if state.cyclel > cycle:
-        state.cycleh += 1
+    if cycle > 0xFFFFFFFF:
+        state.cycleh = (state.cycleh + 1) & 0xFFFFFFFF
+        cycle &= 0xFFFFFFFF
     state.cyclel = cycle
     state.pc = pc
-    return 0
\ No newline at end of file
+    return 0
+
+def MiniRV32IMATimerDeadline(state):
+    # Microseconds of guest time until the timer interrupt is pending, or -1
+    # if the timer is not armed.  A core in WFI sleeps at least this long
+    # unless something else interrupts it.
+    match = (state.timermatchh << 32) | state.timermatchl
+    if not match:
+        return -1
+    return max(match + 1 - ((state.timerh << 32) | state.timerl), 0)
@@ -0,0 +1,93 @@
+/*
+ * Guest side of the mini-rv32ima hypercalls and debug CSRs, see "Hypercalls"
+ * in mini_rv32ima.py.  Addresses are physical, which is what a pointer is on
+ * a nommu kernel or bare metal.  Functions returning int give
+ * MINI_RV32IMA_EFAULT for ranges outside guest RAM.
+ */
+#ifndef MINI_RV32IMA_HYPERCALL_H
+#define MINI_RV32IMA_HYPERCALL_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+#define MINI_RV32IMA_HYPERCALL_COPY    1
+#define MINI_RV32IMA_HYPERCALL_FILL    2
+#define MINI_RV32IMA_HYPERCALL_COMPARE 3
+#define MINI_RV32IMA_HYPERCALL_CLOCK   4
+#define MINI_RV32IMA_HYPERCALL_WRITE   5
+
+#define MINI_RV32IMA_EFAULT (-14)
+#define MINI_RV32IMA_ENOSYS (-38)
+
+static inline uint32_t mini_rv32ima_hypercall(uint32_t op, uint32_t arg0, uint32_t arg1, uint32_t arg2)
+{
+	register uint32_t a0 __asm__("a0") = arg0;
+	register uint32_t a1 __asm__("a1") = arg1;
+	register uint32_t a2 __asm__("a2") = arg2;
+	__asm__ volatile("csrw 0x141, %3" : "+r"(a0), "+r"(a1) : "r"(a2), "r"(op) : "memory");
+	return a0;
+}
+
+/* memmove(dst, src, len), as one host copy. */
+static inline int mini_rv32ima_copy(void *dst, const void *src, size_t len)
+{
+	return (int)mini_rv32ima_hypercall(MINI_RV32IMA_HYPERCALL_COPY, (uint32_t)dst, (uint32_t)src, len);
+}
+
+/* memset(dst, byte, len). */
+static inline int mini_rv32ima_fill(void *dst, int byte, size_t len)
+{
+	return (int)mini_rv32ima_hypercall(MINI_RV32IMA_HYPERCALL_FILL, (uint32_t)dst, (uint32_t)byte, len);
+}
+
+/* memcmp(a, b, len): -1, 0 or 1. */
+static inline int mini_rv32ima_compare(const void *a, const void *b, size_t len)
+{
+	return (int)mini_rv32ima_hypercall(MINI_RV32IMA_HYPERCALL_COMPARE, (uint32_t)a, (uint32_t)b, len);
+}
+
+/* Host monotonic clock in nanoseconds. */
+static inline uint64_t mini_rv32ima_clock(void)
+{
+	register uint32_t a0 __asm__("a0");
+	register uint32_t a1 __asm__("a1");
+	__asm__ volatile("csrw 0x141, %2" : "=r"(a0), "=r"(a1) : "r"(MINI_RV32IMA_HYPERCALL_CLOCK));
+	return ((uint64_t)a1 << 32) | a0;
+}
+
+/* Writes len bytes of buf to the console, returns len. */
+static inline int mini_rv32ima_write(const void *buf, size_t len)
+{
+	return (int)mini_rv32ima_hypercall(MINI_RV32IMA_HYPERCALL_WRITE, (uint32_t)buf, len, 0);
+}
+
+/* Debug CSRs. */
+static inline void mini_rv32ima_print_dec(uint32_t value)
+{
+	__asm__ volatile("csrw 0x136, %0" : : "r"(value));
+}
+
+static inline void mini_rv32ima_print_hex(uint32_t value)
+{
+	__asm__ volatile("csrw 0x137, %0" : : "r"(value));
+}
+
+static inline void mini_rv32ima_print_str(const char *str)
+{
+	__asm__ volatile("csrw 0x138, %0" : : "r"(str) : "memory");
+}
+
+static inline void mini_rv32ima_putc(int c)
+{
+	__asm__ volatile("csrw 0x139, %0" : : "r"(c));
+}
+
+/* The next key typed, or -1 if there is none. */
+static inline int mini_rv32ima_getc(void)
+{
+	int c;
+	__asm__ volatile("csrr %0, 0x140" : "=r"(c));
+	return c;
+}
+
+#endif
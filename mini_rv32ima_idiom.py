@@ -0,0 +1,219 @@
+import mini_rv32ima_decoder as rv32
+from mini_rv32ima_decoder import MINIRV32_RAM_IMAGE_OFFSET, MINIRV32_SIGNED, MINIRV32_STORE_RANGE
+from mini_rv32ima_decoder import MiniRV32IMADecode
+
+# Idiom recognition.
+# Guest loops that only fill, copy or scan memory, which is what memset,
+# memcpy, memmove and strlen compile to, are recognised by their shape when the
+# block at their head is translated, whatever registers they use.  The body
+# is loads, stores and register increments (addi r, r, c), possibly unrolled,
+# and ends in a branch back to the head taken until a pointer or counter
+# reaches an end register (bne, bltu) or, for a scan, until the byte loaded
+# is zero (bnez).  The idiom then runs as many whole iterations as the step
+# has instructions for as one operation on the image, leaves the registers as
+# the last of them would have, and counts all their instructions.
+# Whatever would not behave exactly like the loop runs as the plain block:
+# accesses outside RAM (or in its last 3 bytes, which loads and stores treat
+# as MMIO), stores over the loop itself, copies overlapping in the direction
+# that would repeat data, and counts that wrap around.
+
+MINIRV32_IDIOM_MAX_BODY = 16
+
+MINIRV32_IDIOM_LOAD_WIDTH = {0: 1, 1: 2, 2: 4, 4: 1, 5: 2}
+MINIRV32_IDIOM_STORE_WIDTH = {0: 1, 1: 2, 2: 4}
+
+def MiniRV32IMAIdiomValue(data, funct3):
+    # The register value a load of data with funct3 leaves.
+    val = int.from_bytes(data, 'little', signed=funct3 < 4)
+    return val & 0xFFFFFFFF
+
+def MiniRV32IMAIdiomStream(accesses, steps, width):
+    # accesses are (index, base, offset) of one array accessed by a loop:
+    # returns (base, step, offsets) where offsets are relative to the base at
+    # the start of the iteration, or None unless they tile the step exactly.
+    bases = {base for index, base, offset in accesses}
+    if len(bases) != 1:
+        return None
+    base = bases.pop()
+    if base not in steps:
+        return None
+    step, step_index = steps[base]
+    rels = [offset + (step if step_index < index else 0) for index, base, offset in accesses]
+    first = min(rels)
+    if sorted(rels) != list(range(first, first + len(rels) * width, width)) or abs(step) != len(rels) * width:
+        return None
+    return base, step, rels
+
+def MiniRV32IMAIdiomIterations(cond, r0, step, end):
+    # Iterations of a loop that steps r0 by step and goes on while cond holds
+    # for the stepped value and end, or None if it would wrap around.
+    if cond == 'ne':
+        distance = (end - r0) & 0xFFFFFFFF if step > 0 else (r0 - end) & 0xFFFFFFFF
+        if not distance or distance % abs(step):
+            return None
+        return distance // abs(step)
+    if cond == 'ltu':
+        n = max(-(-(end - r0) // step), 1)
+        return n if r0 + n * step <= 0xFFFFFFFF else None
+    # 'gtu', end < r going down.
+    n = max(-(-(r0 - end) // -step), 1)
+    return n if r0 + n * step >= 0 else None
+
+def MiniRV32IMAMatchIdiom(head, image, fallback):
+    # Returns the block running the loop at head as an idiom, or None if it is
+    # not one.  fallback is the plain block for head.
+    ram_size = len(image)
+    ofs_head = (head - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+    body = []
+    while True:
+        ofs = ofs_head + 4 * len(body)
+        if len(body) > MINIRV32_IDIOM_MAX_BODY or ofs >= ram_size - 3 or ofs & 3:
+            return None
+        decoded = MiniRV32IMADecode(rv32.MINIRV32_LOAD4(image, ofs))
+        if decoded[0] == 0x63:
+            break
+        body.append(decoded)
+    cmd, rdid, branch_rs1, branch_rs2, branch_funct3, imm, ir = decoded
+    if (head + 4 * len(body) + imm) & 0xFFFFFFFF != head:
+        return None
+    length = len(body) + 1
+
+    steps = {}   # register -> (increment, index of the addi)
+    loads = []   # (index, rd, base, offset, funct3)
+    stores = []  # (index, value register, base, offset, funct3)
+    for index, (cmd, rdid, rs1, rs2, funct3, imm, ir) in enumerate(body):
+        if cmd == 0x13 and funct3 == 0 and rdid and rdid == rs1 and rdid not in steps and MINIRV32_SIGNED(imm):
+            steps[rdid] = (MINIRV32_SIGNED(imm), index)
+        elif cmd == 0x03 and funct3 in MINIRV32_IDIOM_LOAD_WIDTH and rdid:
+            loads.append((index, rdid, rs1, MINIRV32_SIGNED(imm), funct3))
+        elif cmd == 0x23 and funct3 in MINIRV32_IDIOM_STORE_WIDTH:
+            stores.append((index, rs2, rs1, MINIRV32_SIGNED(imm), funct3))
+        else:
+            return None
+    temps = {load[1] for load in loads}
+    if temps & set(steps) or any(load[2] in temps for load in loads) or any(store[2] in temps for store in stores):
+        return None
+    written = temps | set(steps)
+
+    if stores:
+        width = MINIRV32_IDIOM_STORE_WIDTH[stores[0][4]]
+        if any(MINIRV32_IDIOM_STORE_WIDTH[store[4]] != width for store in stores):
+            return None
+        dst = MiniRV32IMAIdiomStream([(index, base, offset) for index, value, base, offset, funct3 in stores], steps, width)
+        if dst is None:
+            return None
+        if not loads:
+            # Fill: every store writes the same register, set outside the loop.
+            values = {store[1] for store in stores}
+            if len(values) != 1 or values & written:
+                return None
+            kind = 'fill'
+            fill_value = values.pop()
+        else:
+            # Copy: every store writes what the latest load into its register
+            # read, element for element.
+            if len(loads) != len(stores) or any(MINIRV32_IDIOM_LOAD_WIDTH[load[4]] != width for load in loads):
+                return None
+            src = MiniRV32IMAIdiomStream([(index, base, offset) for index, rd, base, offset, funct3 in loads], steps, width)
+            if src is None or src[1] != dst[1]:
+                return None
+            used = set()
+            for i, (index, value, base, offset, funct3) in enumerate(stores):
+                before = [j for j, load in enumerate(loads) if load[0] < index and load[1] == value]
+                if not before or before[-1] in used:
+                    return None
+                j = before[-1]
+                if dst[2][i] - min(dst[2]) != src[2][j] - min(src[2]):
+                    return None
+                used.add(j)
+            kind = 'copy'
+    else:
+        # Scan: one byte loaded per iteration, until it is zero.
+        if len(loads) != 1 or MINIRV32_IDIOM_LOAD_WIDTH[loads[0][4]] != 1:
+            return None
+        src = MiniRV32IMAIdiomStream([(loads[0][0], loads[0][2], loads[0][3])], steps, 1)
+        if src is None or src[1] != 1:
+            return None
+        kind = 'scan'
+
+    if kind == 'scan':
+        if branch_funct3 != 1 or {branch_rs1, branch_rs2} != {loads[0][1], 0}:
+            return None
+    else:
+        if branch_funct3 == 1 and branch_rs1 in steps and branch_rs2 not in written:
+            cond, counter, end = 'ne', branch_rs1, branch_rs2
+        elif branch_funct3 == 1 and branch_rs2 in steps and branch_rs1 not in written:
+            cond, counter, end = 'ne', branch_rs2, branch_rs1
+        elif branch_funct3 == 6 and branch_rs1 in steps and branch_rs2 not in written and steps[branch_rs1][0] > 0:
+            cond, counter, end = 'ltu', branch_rs1, branch_rs2
+        elif branch_funct3 == 6 and branch_rs2 in steps and branch_rs1 not in written and steps[branch_rs2][0] < 0:
+            cond, counter, end = 'gtu', branch_rs2, branch_rs1
+        else:
+            return None
+        counter_step = steps[counter][0]
+
+    step_items = [(reg, step) for reg, (step, index) in steps.items()]
+    code_end = ofs_head + 4 * length
+    exit_pc = (head + 4 * length) & 0xFFFFFFFF
+    limit = ram_size - 3
+
+    def region(regs, stream, n):
+        # Bytes the stream covers in n iterations, as image offsets.
+        base, step, rels = stream
+        start = ((regs[base] - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF) + min(rels)
+        if step > 0:
+            return start, start + n * step
+        return start + (n - 1) * step, start - step
+
+    def last_loads(regs, n):
+        # What the loads of the last iteration leave in their registers.
+        base, step, rels = src
+        start = ((regs[base] - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF) + (n - 1) * step
+        width = MINIRV32_IDIOM_LOAD_WIDTH[loads[0][4]]
+        return [(load[1], MiniRV32IMAIdiomValue(image[start + rel:start + rel + width], load[4])) for load, rel in zip(loads, rels)]
+
+    if kind == 'scan':
+        def idiom(regs, image, count):
+            start, end = region(regs, src, 1)
+            stop = min(start + count // length, limit)
+            if start < 0 or start >= stop:
+                return fallback(regs, image, count)
+            zero = image.find(b'\0', start, stop)
+            n = zero - start + 1 if zero >= 0 else stop - start
+            temps = last_loads(regs, n)
+            for reg, step in step_items:
+                regs[reg] = (regs[reg] + n * step) & 0xFFFFFFFF
+            for reg, val in temps:
+                regs[reg] = val
+            return (exit_pc if zero >= 0 else head), n * length
+        return idiom
+
+    def idiom(regs, image, count):
+        total = MiniRV32IMAIdiomIterations(cond, regs[counter], counter_step, regs[end])
+        if total is None:
+            return fallback(regs, image, count)
+        n = min(total, count // length)
+        lo, hi = region(regs, dst, n)
+        if lo < 0 or hi > limit or (lo < code_end and ofs_head < hi):
+            return fallback(regs, image, count)
+        if kind == 'fill':
+            width = MINIRV32_IDIOM_STORE_WIDTH[stores[0][4]]
+            image[lo:hi] = (regs[fill_value] & ((1 << (width * 8)) - 1)).to_bytes(width, 'little') * ((hi - lo) // width)
+        else:
+            src_lo, src_hi = region(regs, src, n)
+            if src_lo < 0 or src_hi > limit:
+                return fallback(regs, image, count)
+            if src_lo < hi and lo < src_hi:
+                # Overlapping: the loop is a memmove only if each element is
+                # read before it is overwritten, one element per iteration.
+                if len(stores) != 1 or (lo > src_lo) != (dst[1] < 0):
+                    return fallback(regs, image, count)
+            temps = last_loads(regs, n)
+            image.move(lo, src_lo, hi - lo)
+            for reg, val in temps:
+                regs[reg] = val
+        MINIRV32_STORE_RANGE(image, lo, hi - lo)
+        for reg, step in step_items:
+            regs[reg] = (regs[reg] + n * step) & 0xFFFFFFFF
+        return (exit_pc if n == total else head), n * length
+    return idiom
@@ -0,0 +1,125 @@
+import sys
+import random
+from mini_rv32ima_decoder import *
+from mini_rv32ima_translator import MINIRV32_BLOCK_GLOBALS, MUL_OPS
+
+# RV32M differential check.
+# Compares the integer helpers (MINIRV32_MULH, MINIRV32_MULHSU, MINIRV32_DIV,
+# MINIRV32_REM), the interpreter's RV32M handlers and the translator's RV32M
+# expressions with a reference written straight from the C original's casts,
+# over the edge operands (0, +-1, INT32_MIN, INT32_MAX, ...) paired with each
+# other and randomized operands.  Prints the mismatches and exits non-zero if
+# there are any.
+
+MDCHECK_EDGES = [0, 1, 2, 3, 0x7FFFFFFF, 0x80000000, 0x80000001, 0xFFFFFFFF, 0xFFFFFFFE, 0x10000, 0xFFFF0000]
+
+# Reference: the C expressions with int32_t/int64_t/uint64_t casts done by hand.
+def RefInt32(x):
+    return x - (1 << 32) if x & 0x80000000 else x
+
+def RefTruncDiv(a, b):
+    # C division rounds toward zero.
+    q = a // b
+    if q < 0 and q * b != a:
+        q += 1
+    return q
+
+def RefMulDiv(funct3, rs1, rs2):
+    if funct3 == 0:  # MUL: (uint32_t)(rs1 * rs2)
+        return (rs1 * rs2) & 0xFFFFFFFF
+    if funct3 == 1:  # MULH: ((int64_t)(int32_t)rs1 * (int64_t)(int32_t)rs2) >> 32
+        return ((RefInt32(rs1) * RefInt32(rs2)) >> 32) & 0xFFFFFFFF
+    if funct3 == 2:  # MULHSU: ((int64_t)(int32_t)rs1 * (uint64_t)rs2) >> 32, in uint64_t
+        return (((RefInt32(rs1) * rs2) & 0xFFFFFFFFFFFFFFFF) >> 32) & 0xFFFFFFFF
+    if funct3 == 3:  # MULHU: ((uint64_t)rs1 * (uint64_t)rs2) >> 32
+        return (rs1 * rs2) >> 32
+    if funct3 == 4:  # DIV
+        if rs2 == 0:
+            return 0xFFFFFFFF
+        if RefInt32(rs1) == -(1 << 31) and RefInt32(rs2) == -1:
+            return rs1
+        return RefTruncDiv(RefInt32(rs1), RefInt32(rs2)) & 0xFFFFFFFF
+    if funct3 == 5:  # DIVU
+        return rs1 // rs2 if rs2 else 0xFFFFFFFF
+    if funct3 == 6:  # REM
+        if rs2 == 0:
+            return rs1
+        if RefInt32(rs1) == -(1 << 31) and RefInt32(rs2) == -1:
+            return 0
+        a = RefInt32(rs1)
+        b = RefInt32(rs2)
+        return (a - b * RefTruncDiv(a, b)) & 0xFFFFFFFF
+    return rs1 % rs2 if rs2 else rs1  # REMU
+
+MDCHECK_NAMES = ['mul', 'mulh', 'mulhsu', 'mulhu', 'div', 'divu', 'rem', 'remu']
+MDCHECK_HELPERS = {1: MINIRV32_MULH, 2: MINIRV32_MULHSU, 4: MINIRV32_DIV, 6: MINIRV32_REM}
+
+def Implementations():
+    # (name, funct3, fn(rs1, rs2)) for everything computing an RV32M result.
+    impls = []
+    for funct3, helper in MDCHECK_HELPERS.items():
+        impls.append((f"MINIRV32_{MDCHECK_NAMES[funct3].upper()}", funct3, helper))
+    for funct3, constructor in enumerate(MINIRV32_OP_M):
+        op = constructor(3, 1, 2, funct3, 0, 0)
+        def run(rs1, rs2, op=op):
+            regs = [0, rs1, rs2, 0]
+            op(None, regs, None, 0, 0)
+            return regs[3]
+        impls.append((f"OP_{MDCHECK_NAMES[funct3].upper()}", funct3, run))
+    for funct3, expr in MUL_OPS.items():
+        code = compile(expr.format('a', 'b'), f"<{MDCHECK_NAMES[funct3]}>", 'eval')
+        def run(rs1, rs2, code=code):
+            return eval(code, MINIRV32_BLOCK_GLOBALS, {'a': rs1, 'b': rs2})
+        impls.append((f"block {MDCHECK_NAMES[funct3]}", funct3, run))
+    return impls
+
+def Operands(count, seed):
+    for a in MDCHECK_EDGES:
+        for b in MDCHECK_EDGES:
+            yield a, b
+    rng = random.Random(seed)
+    for i in range(count):
+        a = rng.getrandbits(32)
+        b = rng.getrandbits(32)
+        # Mixed signs for MULHSU/DIV/REM, and small divisors.
+        if i & 3 == 1:
+            a |= 0x80000000
+            b &= 0x7FFFFFFF
+        elif i & 3 == 2:
+            b = rng.choice(MDCHECK_EDGES) if i & 4 else rng.getrandbits(rng.randint(1, 8))
+        yield a, b
+
+def main(argv):
+    count = 200000
+    seed = 1
+    i = 1
+    while i < len(argv):
+        param = argv[i]
+        if i + 1 < len(argv) and param in ('-n', '-s'):
+            i += 1
+            if param == '-n':
+                count = int(argv[i], 0)
+            else:
+                seed = int(argv[i], 0)
+        else:
+            print(f"./mini_rv32ima_mdcheck.py [parameters]\n\t-n random operand pairs (default {count})\n\t-s random seed (default {seed})\n")
+            return 1
+        i += 1
+
+    impls = Implementations()
+    failures = 0
+    checked = 0
+    for a, b in Operands(count, seed):
+        for name, funct3, fn in impls:
+            expected = RefMulDiv(funct3, a, b)
+            got = fn(a, b)
+            checked += 1
+            if got != expected:
+                failures += 1
+                if failures <= 20:
+                    print(f"{name}(0x{a:08x}, 0x{b:08x}) = 0x{got:08x}, expected 0x{expected:08x}")
+    print(f"{checked} results checked, {failures} mismatches")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
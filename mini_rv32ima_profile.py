@@ -0,0 +1,184 @@
+import bisect
+import struct
+from mini_rv32ima_decoder import SET_PROFILE_OP
+
+# Guest profiler.
+# Counts every instruction the interpreter executes by guest pc and by the call
+# stack it ran under, through the profile_op hook of the image.  The call stack
+# is a shadow stack kept from the instruction stream: JAL/JALR linking ra or t0
+# push a frame, JALR through ra or t0 pops back to the frame it returns into,
+# trap entry (executing at mtvec) pushes a frame that mret pops.  A return that
+# matches no frame (a context switch, longjmp) empties the stack.
+# At the end it writes a flat profile with the instruction class mix, and the
+# stacks in the collapsed format read by flamegraph.pl and speedscope.
+
+MINIRV32_PROFILE_MAX_DEPTH = 128
+
+MINIRV32_OPCODE_CLASS = {
+    0x37: 'lui',
+    0x17: 'auipc',
+    0x6F: 'jal',
+    0x67: 'jalr',
+    0x63: 'branch',
+    0x03: 'load',
+    0x23: 'store',
+    0x13: 'op-imm',
+    0x33: 'op',
+    0x0f: 'fence',
+    0x73: 'system',
+    0x2f: 'amo',
+}
+
+def MiniRV32IMAOpClass(decoded):
+    cmd, rdid, rs1, rs2, funct3, imm, ir = decoded
+    if cmd == 0x33 and ir & 0x02000000:
+        return 'muldiv'
+    if cmd == 0x73 and funct3:
+        return 'csr'
+    return MINIRV32_OPCODE_CLASS.get(cmd, 'illegal')
+
+class MiniRV32IMASymbols:
+    # Sorted function symbols of the guest, from a System.map or an ELF file.
+    def __init__(self, file_name=None):
+        self.addrs = []
+        self.names = []
+        if file_name:
+            with open(file_name, "rb") as f:
+                data = f.read()
+            symbols = self.read_elf(data) if data[:4] == b'\x7fELF' else self.read_map(data)
+            for addr, name in sorted(symbols):
+                self.addrs.append(addr)
+                self.names.append(name)
+
+    @staticmethod
+    def read_map(data):
+        symbols = []
+        for line in data.decode(errors='replace').splitlines():
+            fields = line.split()
+            if len(fields) >= 3 and fields[1] in ('T', 't', 'W', 'w'):
+                try:
+                    symbols.append((int(fields[0], 16), fields[2]))
+                except ValueError:
+                    pass
+        return symbols
+
+    @staticmethod
+    def read_elf(data):
+        # 32 bit little endian ELF only, like the guest.
+        if data[4] != 1 or data[5] != 1:
+            raise ValueError("not a 32 bit little endian ELF file")
+        shoff, = struct.unpack_from('<I', data, 0x20)
+        shentsize, shnum = struct.unpack_from('<HH', data, 0x2E)
+        sections = [struct.unpack_from('<10I', data, shoff + i * shentsize) for i in range(shnum)]
+        symbols = []
+        for sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info, sh_addralign, sh_entsize in sections:
+            if sh_type != 2:  # SHT_SYMTAB
+                continue
+            strtab = sections[sh_link][4]
+            for ofs in range(sh_offset, sh_offset + sh_size, 16):
+                st_name, st_value, st_size, st_info, st_other, st_shndx = struct.unpack_from('<IIIBBH', data, ofs)
+                if (st_info & 0xF) not in (0, 2) or not st_shndx or not st_name:  # NOTYPE or FUNC, defined
+                    continue
+                end = data.index(b'\0', strtab + st_name)
+                name = data[strtab + st_name:end].decode(errors='replace')
+                if not name.startswith(('$', '.L')):
+                    symbols.append((st_value, name))
+        return symbols
+
+    def lookup(self, addr):
+        i = bisect.bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return f"0x{addr:08x}"
+        return self.names[i]
+
+class MiniRV32IMAProfiler:
+    def __init__(self):
+        self.counts = {}     # (stack, pc) -> instructions
+        self.classes = {}    # pc -> instruction class
+        self.frames = []     # (entry pc, return pc)
+        self.stack = ()      # entry pcs of self.frames
+
+    def start(self, image):
+        SET_PROFILE_OP(image, self.wrap)
+
+    def stop(self, image):
+        SET_PROFILE_OP(image, None)
+
+    def call(self, entry, ret):
+        frames = self.frames
+        frames.append((entry, ret))
+        if len(frames) > MINIRV32_PROFILE_MAX_DEPTH:
+            del frames[0]
+        self.stack = tuple(frame[0] for frame in frames)
+
+    def ret(self, target):
+        frames = self.frames
+        for i in range(len(frames) - 1, -1, -1):
+            if frames[i][1] == target:
+                del frames[i:]
+                break
+        else:
+            frames.clear()
+        self.stack = tuple(frame[0] for frame in frames)
+
+    def wrap(self, op, pc, decoded):
+        cmd, rdid, rs1, rs2, funct3, imm, ir = decoded
+        self.classes[pc] = MiniRV32IMAOpClass(decoded)
+        is_call = (cmd == 0x6F or cmd == 0x67) and rdid in (1, 5)
+        is_return = cmd == 0x67 and rdid == 0 and rs1 in (1, 5)
+        is_mret = cmd == 0x73 and funct3 == 0 and imm == 0x302
+        ret_pc = (pc + 4) & 0xFFFFFFFF
+        counts = self.counts
+        profiler = self
+
+        def profiled(state, regs, image, pc, cycle):
+            if pc == state.mtvec:
+                profiler.call(pc, state.mepc)
+            key = (profiler.stack, pc)
+            counts[key] = counts.get(key, 0) + 1
+            next_pc = op(state, regs, image, pc, cycle)
+            if is_call:
+                profiler.call(next_pc, ret_pc)
+            elif is_return or is_mret:
+                profiler.ret(next_pc)
+            return next_pc
+        return profiled
+
+    def write_flat(self, f, symbols, top=50):
+        total = sum(self.counts.values()) or 1
+        by_symbol = {}
+        by_class = {}
+        for (stack, pc), n in self.counts.items():
+            name = symbols.lookup(pc)
+            by_symbol[name] = by_symbol.get(name, 0) + n
+            op_class = self.classes.get(pc, 'illegal')
+            by_class[op_class] = by_class.get(op_class, 0) + n
+
+        f.write(f"{total} instructions\n\n  self %  instructions  symbol\n")
+        for name, n in sorted(by_symbol.items(), key=lambda item: -item[1])[:top]:
+            f.write(f"{100.0 * n / total:8.2f}  {n:12}  {name}\n")
+        f.write("\n  mix %  instructions  class\n")
+        for op_class, n in sorted(by_class.items(), key=lambda item: -item[1]):
+            f.write(f"{100.0 * n / total:7.2f}  {n:12}  {op_class}\n")
+
+    def write_collapsed(self, f, symbols):
+        folded = {}
+        for (stack, pc), n in self.counts.items():
+            # The innermost frame is the function pc is in, or after a tail
+            # call the one it jumped to.  Without symbols it stays the entry
+            # of the last call, so each function shows up under one name.
+            names = [symbols.lookup(entry) for entry in stack]
+            if symbols.addrs or not names:
+                names[-1:] = [symbols.lookup(pc)]
+            line = ';'.join(names)
+            folded[line] = folded.get(line, 0) + n
+        for line, n in sorted(folded.items()):
+            f.write(f"{line} {n}\n")
+
+    def write(self, prefix, symbol_file_name=None):
+        # Writes prefix.txt (flat profile) and prefix.folded (collapsed stacks).
+        symbols = MiniRV32IMASymbols(symbol_file_name)
+        with open(prefix + ".txt", "w") as f:
+            self.write_flat(f, symbols)
+        with open(prefix + ".folded", "w") as f:
+            self.write_collapsed(f, symbols)
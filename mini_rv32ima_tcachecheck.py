@@ -0,0 +1,45 @@
+import sys
+import tempfile
+from mini_rv32ima_decoder import MiniRV32IMARam, MINIRV32_RAM_IMAGE_OFFSET
+from mini_rv32ima_translator import MiniRV32IMATranslationCache, MiniRV32IMATranslate
+
+# Translation cache check.
+# Translates the same code in guests of two RAM sizes through one cache
+# directory: the second must not reuse blocks compiled for the first, whose
+# bounds checks hold the other size, and must fault on a load past its RAM
+# instead of indexing outside the image.  Exits non-zero on failure.
+
+# lui s0, 0x80180; lw t0, 0(s0); jal zero, 0
+CHECK_CODE = bytes.fromhex('37041880' '83220400' '6f000000')
+
+def TranslateIn(directory, ram_size):
+    cache = MiniRV32IMATranslationCache(directory)
+    image = MiniRV32IMARam(ram_size)
+    image[0:len(CHECK_CODE)] = CHECK_CODE
+    image.translation_cache = cache
+    block, length = MiniRV32IMATranslate(MINIRV32_RAM_IMAGE_OFFSET, image)
+    hit = not cache.changed
+    cache.save()
+    return image, block, length, hit
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        TranslateIn(directory, 2 << 20)
+        image, block, length, hit = TranslateIn(directory, 2 << 20)
+        if not hit:
+            print("FAIL: same RAM size missed the cache")
+            return 1
+        image, block, length, hit = TranslateIn(directory, 1 << 20)
+        if hit:
+            print("FAIL: other RAM size hit the cache")
+            return 1
+        regs = [0] * 32
+        pc, ninstr = block(regs, image, length)
+        if (pc, ninstr) != (MINIRV32_RAM_IMAGE_OFFSET + 4, 1):
+            print(f"FAIL: load past RAM did not leave the block at it ({pc:08x}, {ninstr})")
+            return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import struct
+import sys
+from mini_rv32ima_decoder import SET_HOOK
+
+# Guest tracer.
+# Records instruction, trap, MMIO and CSR events through the event hooks of
+# the image (see SET_HOOK) as fixed size binary records in a ring buffer, so a
+# run of any length keeps its last events and costs one pack_into per event.
+# write() saves the ring oldest record first, main() prints a saved trace:
+#   python mini_rv32ima_trace.py trace.bin
+
+MINIRV32_TRACE_MAGIC = b'RV32TRAC'
+MINIRV32_TRACE_HEADER = struct.Struct('<8sI')     # magic, record count
+MINIRV32_TRACE_RECORD = struct.Struct('<BxHIII')  # kind, csrno, three values
+MINIRV32_TRACE_RECORDS = 1 << 16
+
+MINIRV32_TRACE_INSTRUCTION = 1  # pc, ir
+MINIRV32_TRACE_TRAP = 2         # mcause, mepc, mtval
+MINIRV32_TRACE_LOAD = 3         # address, value
+MINIRV32_TRACE_STORE = 4        # address, value
+MINIRV32_TRACE_CSR = 5          # csrno: pc, value read, value written
+
+MINIRV32_TRACE_FORMATS = {
+    MINIRV32_TRACE_INSTRUCTION: "I {1:08x} {2:08x}",
+    MINIRV32_TRACE_TRAP: "T mcause={1:08x} mepc={2:08x} mtval={3:08x}",
+    MINIRV32_TRACE_LOAD: "L {1:08x} -> {2:08x}",
+    MINIRV32_TRACE_STORE: "S {1:08x} <- {2:08x}",
+    MINIRV32_TRACE_CSR: "C {1:08x} csr {0:03x} {2:08x} -> {3:08x}",
+}
+
+class MiniRV32IMATracer:
+    def __init__(self, records=MINIRV32_TRACE_RECORDS, events=('instruction', 'trap', 'mmio', 'csr')):
+        self.ring = bytearray(records * MINIRV32_TRACE_RECORD.size)
+        self.records = records
+        self.count = 0  # Records ever written
+        self.events = events
+
+    def start(self, image):
+        for event in self.events:
+            SET_HOOK(image, event, getattr(self, event))
+
+    def stop(self, image):
+        for event in self.events:
+            SET_HOOK(image, event, None)
+
+    def record(self, kind, csrno, a, b, c):
+        MINIRV32_TRACE_RECORD.pack_into(self.ring, (self.count % self.records) * MINIRV32_TRACE_RECORD.size, kind, csrno, a, b, c)
+        self.count += 1
+
+    def instruction(self, pc, ir):
+        self.record(MINIRV32_TRACE_INSTRUCTION, 0, pc, ir, 0)
+
+    def trap(self, mcause, mepc, mtval):
+        self.record(MINIRV32_TRACE_TRAP, 0, mcause, mepc, mtval & 0xFFFFFFFF)
+
+    def mmio(self, addy, val, is_store):
+        self.record(MINIRV32_TRACE_STORE if is_store else MINIRV32_TRACE_LOAD, 0, addy, val & 0xFFFFFFFF, 0)
+
+    def csr(self, pc, csrno, rval, writeval):
+        self.record(MINIRV32_TRACE_CSR, csrno, pc, rval, writeval)
+
+    def raw(self):
+        # The ring in order, oldest record first.
+        size = MINIRV32_TRACE_RECORD.size
+        if self.count <= self.records:
+            return bytes(self.ring[:self.count * size])
+        split = (self.count % self.records) * size
+        return bytes(self.ring[split:] + self.ring[:split])
+
+    def write(self, file_name):
+        data = self.raw()
+        with open(file_name, "wb") as f:
+            f.write(MINIRV32_TRACE_HEADER.pack(MINIRV32_TRACE_MAGIC, len(data) // MINIRV32_TRACE_RECORD.size))
+            f.write(data)
+
+def ReadTrace(file_name):
+    # Yields the records of a trace written by MiniRV32IMATracer.write() as
+    # (kind, csrno, a, b, c).
+    with open(file_name, "rb") as f:
+        data = f.read()
+    magic, count = MINIRV32_TRACE_HEADER.unpack_from(data)
+    if magic != MINIRV32_TRACE_MAGIC:
+        raise ValueError(f"{file_name} is not a trace")
+    yield from MINIRV32_TRACE_RECORD.iter_unpack(data[MINIRV32_TRACE_HEADER.size:MINIRV32_TRACE_HEADER.size + count * MINIRV32_TRACE_RECORD.size])
+
+def main(argv):
+    if len(argv) != 2:
+        print("./mini_rv32ima_trace.py [trace file]")
+        return 1
+    for kind, csrno, a, b, c in ReadTrace(argv[1]):
+        print(MINIRV32_TRACE_FORMATS.get(kind, "? {1:08x} {2:08x} {3:08x}").format(csrno, a, b, c))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
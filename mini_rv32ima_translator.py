@@ -0,0 +1,341 @@
+import os
+import sys
+import marshal
+import hashlib
+import mini_rv32ima_decoder as rv32
+from mini_rv32ima_decoder import MINIRV32_RAM_IMAGE_OFFSET, MINIRV32_DECODE_PAGE_SHIFT
+from mini_rv32ima_decoder import MiniRV32IMADecode, MiniRV32IMAStep
+from mini_rv32ima_idiom import MiniRV32IMAMatchIdiom
+
+# Basic block translator.
+# A block is the run of instructions starting at a pc up to and including the
+# next branch, JAL or JALR.  Its Python source keeps the guest registers in
+# locals, is compiled once and cached in image.block_cache by entry pc
+# together with its length, so a step never runs past its instruction count.
+# Anything the translator does not handle (CSR/SYSTEM, AMO, MMIO accesses,
+# traps) ends the block and is executed by MiniRV32IMAStep, which stays the
+# reference implementation.
+# A block is called as block(regs, image, count) with the instructions left in
+# the step and returns the next pc and the instructions it executed.  Plain
+# blocks ignore count, the loops recognised as memset, memcpy or strlen (see
+# mini_rv32ima_idiom.py) run as many iterations as it allows.
+
+MINIRV32_BLOCK_MAX = 64
+
+# Globals of the compiled blocks.
+MINIRV32_BLOCK_GLOBALS = {
+    'LOAD4': rv32.MINIRV32_LOAD4,
+    'LOAD2': rv32.MINIRV32_LOAD2,
+    'LOAD1': rv32.MINIRV32_LOAD1,
+    'LOAD2_SIGNED': rv32.MINIRV32_LOAD2_SIGNED,
+    'LOAD1_SIGNED': rv32.MINIRV32_LOAD1_SIGNED,
+    'STORE4': rv32.MINIRV32_STORE4,
+    'STORE2': rv32.MINIRV32_STORE2,
+    'STORE1': rv32.MINIRV32_STORE1,
+    'MULH': rv32.MINIRV32_MULH,
+    'MULHSU': rv32.MINIRV32_MULHSU,
+    'DIV': rv32.MINIRV32_DIV,
+    'REM': rv32.MINIRV32_REM,
+}
+
+# Aligned loads index the RAM views (hoisted into locals) directly.
+LOAD_OPS = {
+    0: 's8[addy] & 0xFFFFFFFF',
+    1: '(s16[addy >> 1] if not addy & 1 else LOAD2_SIGNED(image, addy)) & 0xFFFFFFFF',
+    2: 'u32[addy >> 2] if not addy & 3 else LOAD4(image, addy)',
+    4: 'image[addy]',
+    5: 'u16[addy >> 1] if not addy & 1 else LOAD2(image, addy)',
+}
+RAM_VIEWS = ('u32', 'u16', 's16', 's8')
+STORE_OPS = {0: 'STORE1', 1: 'STORE2', 2: 'STORE4'}
+# Signed compares are done on operands with the sign bit flipped.
+BRANCH_OPS = {0: '{0} == {1}', 1: '{0} != {1}', 4: '({0} ^ 0x80000000) < ({1} ^ 0x80000000)', 5: '({0} ^ 0x80000000) >= ({1} ^ 0x80000000)', 6: '{0} < {1}', 7: '{0} >= {1}'}
+ALU_OPS = {
+    0: '({0} + {1}) & 0xFFFFFFFF',
+    1: '({0} << ({1} & 0x1F)) & 0xFFFFFFFF',
+    2: 'int(({0} ^ 0x80000000) < ({1} ^ 0x80000000))',
+    3: 'int({0} < {1})',
+    4: '{0} ^ {1}',
+    5: '{0} >> ({1} & 0x1F)',
+    6: '{0} | {1}',
+    7: '{0} & {1}',
+}
+MUL_OPS = {
+    0: '({0} * {1}) & 0xFFFFFFFF',
+    1: 'MULH({0}, {1})',
+    2: 'MULHSU({0}, {1})',
+    3: '({0} * {1}) >> 32',
+    4: 'DIV({0}, {1})',
+    5: '({0} // {1}) if {1} else 0xFFFFFFFF',
+    6: 'REM({0}, {1})',
+    7: '({0} % {1}) if {1} else {0}',
+}
+
+def TranslateOp(decoded, pc, exit, ram_size):
+    # Returns (source lines, registers read, registers written, ends block)
+    # or None if the instruction has to go through the interpreter.
+    cmd, rdid, rs1id, rs2id, funct3, imm, ir = decoded
+    rs1 = 'x%d' % rs1id if rs1id else '0'
+    rs2 = 'x%d' % rs2id if rs2id else '0'
+    rd = 'x%d' % rdid
+    reads = {rs1id, rs2id}
+    writes = {rdid} if rdid else set()
+    next_pc = (pc + 4) & 0xFFFFFFFF
+
+    if cmd == 0x37:  # LUI
+        return ['%s = %d' % (rd, imm)] if rdid else [], set(), writes, False
+    elif cmd == 0x17:  # AUIPC
+        return ['%s = %d' % (rd, (pc + imm) & 0xFFFFFFFF)] if rdid else [], set(), writes, False
+    elif cmd == 0x6F:  # JAL
+        lines = ['%s = %d' % (rd, next_pc)] if rdid else []
+        return lines + [exit((pc + imm) & 0xFFFFFFFF)], set(), writes, True
+    elif cmd == 0x67:  # JALR
+        lines = ['target = (%s + %d) & 0xFFFFFFFE' % (rs1, imm)]
+        if rdid:
+            lines.append('%s = %d' % (rd, next_pc))
+        return lines + [exit('target')], {rs1id}, writes, True
+    elif cmd == 0x63:  # Branch
+        if funct3 not in BRANCH_OPS:
+            return None
+        lines = ['if ' + BRANCH_OPS[funct3].format(rs1, rs2) + ':', '    ' + exit((pc + imm) & 0xFFFFFFFF), exit(next_pc)]
+        return lines, reads, set(), True
+    elif cmd == 0x03:  # Load
+        if funct3 not in LOAD_OPS:
+            return None
+        lines = ['addy = (%s + %d) & 0xFFFFFFFF' % (rs1, (imm - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF),
+                 'if addy >= %d:' % (ram_size - 3),
+                 '    ' + exit(pc, interp=True)]
+        if rdid:
+            lines.append('%s = %s' % (rd, LOAD_OPS[funct3]))
+        return lines, {rs1id}, writes, False
+    elif cmd == 0x23:  # Store
+        if funct3 not in STORE_OPS:
+            return None
+        lines = ['addy = (%s + %d) & 0xFFFFFFFF' % (rs1, (imm - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF),
+                 'if addy >= %d:' % (ram_size - 3),
+                 '    ' + exit(pc, interp=True),
+                 '%s(image, addy, %s)' % (STORE_OPS[funct3], rs2)]
+        return lines, reads, set(), False
+    elif cmd == 0x13 or cmd == 0x33:  # Op-immediate or Op
+        is_reg = ir & 0x20
+        if is_reg and (ir & 0x02000000):
+            expr = MUL_OPS[funct3]
+        elif funct3 == 0 and is_reg and (ir & 0x40000000):
+            expr = '({0} - {1}) & 0xFFFFFFFF'
+        elif funct3 == 5 and (ir & 0x40000000):
+            expr = '((({0} ^ 0x80000000) - 0x80000000) >> ({1} & 0x1F)) & 0xFFFFFFFF'
+        else:
+            expr = ALU_OPS[funct3]
+        if not is_reg:
+            rs2 = str(imm)
+            reads = {rs1id}
+        return ['%s = %s' % (rd, expr.format(rs1, rs2))] if rdid else [], reads, writes, False
+    elif cmd == 0x0f:  # Fences are ignored
+        return [], set(), set(), False
+    return None
+
+# Persistent translation cache.
+# Keeps the compiled code of blocks on disk so later runs of the same guest do
+# not translate them again.  A file holds the blocks starting in one page and
+# not running past it, named by a hash of the RAM size (blocks embed it in
+# their bounds checks), the page's address and contents, the cache version and
+# the Python bytecode tag.  A page whose code changed, RAM of another size or a
+# different emulator finds no file, so stale entries cost nothing to detect.
+# The file of a page is read the first time a block starting in it is
+# translated.  save() writes the pages that got new blocks, then removes the
+# least recently used files (reads touch them) beyond max_bytes.  One cache can
+# serve any number of machines; set it as image.translation_cache.
+MINIRV32_TCACHE_VERSION = 1
+MINIRV32_TCACHE_MAX = 256 << 20
+
+class MiniRV32IMATranslationCache:
+    def __init__(self, directory, max_bytes=MINIRV32_TCACHE_MAX):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = f"{MINIRV32_TCACHE_VERSION} {sys.implementation.cache_tag}".encode()
+        self.pages = {}       # key -> {pc: (code, length)}
+        self.changed = set()  # keys with blocks not saved yet
+
+    def key(self, image, page):
+        ofs = page << MINIRV32_DECODE_PAGE_SHIFT
+        h = hashlib.blake2b(self.salt, digest_size=16)
+        h.update(len(image).to_bytes(4, 'little'))
+        h.update(page.to_bytes(4, 'little'))
+        h.update(image.s8[ofs:ofs + (1 << MINIRV32_DECODE_PAGE_SHIFT)])
+        return h.hexdigest()
+
+    def lookup(self, key, pc):
+        blocks = self.pages.get(key)
+        if blocks is None:
+            blocks = {}
+            path = os.path.join(self.directory, key)
+            try:
+                with open(path, "rb") as f:
+                    blocks = marshal.load(f)
+                os.utime(path)
+            except (OSError, EOFError, ValueError, TypeError):
+                pass  # Not cached yet, or cut short by a crash
+            self.pages[key] = blocks
+        return blocks.get(pc)
+
+    def add(self, key, pc, code, length):
+        self.pages[key][pc] = (code, length)
+        self.changed.add(key)
+
+    def save(self):
+        for key in self.changed:
+            path = os.path.join(self.directory, key)
+            tmp_name = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_name, "wb") as f:
+                marshal.dump(self.pages[key], f)
+            os.replace(tmp_name, path)
+        self.changed.clear()
+
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+def MiniRV32IMACompileBlock(pc, image, ofs_pc):
+    # Translates the block at pc into compiled code defining block(), returns
+    # (code, length).  code is None if its first instruction cannot be
+    # translated.
+    ram_size = len(image)
+
+    # Exits are patched in once the set of written registers is known.
+    exits = []
+    def exit(target, interp=False):
+        exits.append((target, ninstr + (0 if interp else 1)))
+        return '@EXIT%d@' % (len(exits) - 1)
+
+    body = []
+    reads = set()
+    writes = set()
+    ninstr = 0
+    end_pc = pc
+    while ninstr < MINIRV32_BLOCK_MAX and ofs_pc < ram_size - 3:
+        op = TranslateOp(MiniRV32IMADecode(rv32.MINIRV32_LOAD4(image, ofs_pc)), end_pc, exit, ram_size)
+        if op is None:
+            break
+        lines, op_reads, op_writes, ends_block = op
+        body += lines
+        reads |= op_reads
+        writes |= op_writes
+        ninstr += 1
+        end_pc = (end_pc + 4) & 0xFFFFFFFF
+        ofs_pc += 4
+        if ends_block:
+            break
+    else:
+        body.append(exit(end_pc, interp=True))
+    if ninstr == 0:
+        return None, 0
+    if not body or not body[-1].startswith('@EXIT'):
+        body.append(exit(end_pc, interp=True))
+    reads.discard(0)
+    writeback = ''.join('regs[%d] = x%d; ' % (r, r) for r in sorted(writes))
+    src = ['def block(regs, image, count):']
+    text = '\n'.join(body)
+    src += ['    %s = image.%s' % (view, view) for view in RAM_VIEWS if view + '[' in text]
+    src += ['    x%d = regs[%d]' % (r, r) for r in sorted(reads | writes)]
+    for line in body:
+        if '@EXIT' in line:
+            n = int(line[line.index('@EXIT') + 5:-1])
+            target, count = exits[n]
+            line = line[:line.index('@EXIT')] + writeback + 'return %s, %d' % (target, count)
+        src.append('    ' + line)
+    return compile('\n'.join(src), '<block %08x>' % pc, 'exec'), ninstr
+
+def MiniRV32IMATranslate(pc, image):
+    # Translates the block at pc, caches and returns (block, length).  Returns
+    # None if pc is not in RAM, block is False if its first instruction cannot
+    # be translated.
+    ram_size = len(image)
+    ofs_pc = (pc - MINIRV32_RAM_IMAGE_OFFSET) & 0xFFFFFFFF
+    if ofs_pc >= ram_size - 3 or ofs_pc & 3:
+        return None
+
+    first_page = ofs_pc >> MINIRV32_DECODE_PAGE_SHIFT
+    translation_cache = image.translation_cache
+    cached = None
+    if translation_cache is not None:
+        key = translation_cache.key(image, first_page)
+        cached = translation_cache.lookup(key, pc)
+    if cached is not None:
+        code, ninstr = cached
+    else:
+        code, ninstr = MiniRV32IMACompileBlock(pc, image, ofs_pc)
+    last_page = (ofs_pc + 4 * ninstr - 1) >> MINIRV32_DECODE_PAGE_SHIFT
+    if translation_cache is not None and cached is None and last_page <= first_page:
+        translation_cache.add(key, pc, code, ninstr)
+
+    if code is None:
+        block = False
+    else:
+        namespace = dict(MINIRV32_BLOCK_GLOBALS)
+        exec(code, namespace)
+        block = namespace['block']
+        block = MiniRV32IMAMatchIdiom(pc, image, block) or block
+
+    image.block_cache[pc] = (block, ninstr)
+    decode_pages = image.decode_pages
+    for page in range(first_page, max(first_page, last_page) + 1):
+        if page in decode_pages:
+            decode_pages[page].append(pc)
+        else:
+            decode_pages[page] = [pc]
+    return (block, ninstr)
+
+def MiniRV32IMAStepBlocks(state, image, vProcAddress, elapsedUs, count):
+    # Same contract as MiniRV32IMAStep.  The timer update, WFI and pending
+    # interrupts are handled by running the interpreter for zero instructions.
+    # Blocks do not report instructions, so with an instruction hook set all
+    # of them go through the interpreter.
+    if image.instruction_hook is not None:
+        return MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, count)
+    ret = MiniRV32IMAStep(state, image, vProcAddress, elapsedUs, 0)
+    if ret:
+        return ret
+
+    blocks = image.block_cache
+    regs = state.regs
+    pc = state.pc
+    cycle = state.cyclel
+    while count > 0:
+        entry = blocks.get(pc)
+        if entry is None:
+            entry = MiniRV32IMATranslate(pc, image)
+        if entry and 0 < entry[1] <= count:
+            pc, ninstr = entry[0](regs, image, count)
+            if ninstr:
+                cycle += ninstr
+                count -= ninstr
+                continue
+
+        # Fall back to the interpreter for one instruction.
+        state.pc = pc
+        state.cyclel = cycle
+        ret = MiniRV32IMAStep(state, image, vProcAddress, 0, 1)
+        if ret:
+            return ret
+        pc = state.pc
+        cycle = state.cyclel
+        count -= 1
+
+    if cycle > 0xFFFFFFFF:
+        state.cycleh = (state.cycleh + 1) & 0xFFFFFFFF
+        cycle &= 0xFFFFFFFF
+    state.pc = pc
+    state.cyclel = cycle
+    return 0